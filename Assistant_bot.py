@@ -1,24 +1,99 @@
-import pickle
 import re
 import os
-import shutil
-from datetime import datetime
-from collections import UserDict
-from copy import deepcopy
-from difflib import SequenceMatcher
+import gc
+import json
+import shlex
+import sys
+import math
+import time
+import heapq
+from functools import wraps
+from importlib import import_module
+from argparse import ArgumentParser
+from datetime import datetime, date, timedelta
+from bisect import bisect_left, insort
+from calendar import isleap
+from collections import UserDict, Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from weakref import WeakSet
+from collections.abc import Mapping
+from itertools import islice
+from threading import Thread, Event, Lock, RLock
 from abc import ABC, abstractmethod
+# pickle, sqlite3, csv, hashlib, shutil, zlib, lzma, asyncio and concurrent.futures are imported where they are used:
+# most sessions need few of them, and together they took longer to import than everything else
+
+
+OUTPUT_BUFFER = 64 * 1024     # characters collected before the console is written to
 
 
 class DisplayView(ABC):
     @abstractmethod
-    def display(self):
+    def display(self, data):
         pass
 
-class ConsoleView(DisplayView):
+    def flush(self):        # views that hold output back write it here
+        pass
+
+class ConsoleView(DisplayView):     # output goes out in large writes, flush() before waiting for the user
+    def __init__(self, limit: int = OUTPUT_BUFFER) -> None:
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.lock = Lock()      # autosave and reminders write from their own threads
+
+    def display(self, data, end: str = '\n'):
+        text = f'{data}{end}'
+        with self.lock:
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size >= self.limit:
+                self._write()
+
+    def flush(self):
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        if self.parts:
+            sys.stdout.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+        sys.stdout.flush()
+
+class CollectingView(DisplayView):      # keeps the output of a command, e.g. to send it to a client
+    def __init__(self) -> None:
+        self.lines = []
+
     def display(self, data):
-        print(data)
+        self.lines.append(str(data))
+
+    def text(self) -> str:
+        return '\n'.join(self.lines)
+
+class Slotted:
+    __slots__ = ()      # contact data has no per-instance __dict__ to keep millions of records small
+
+    def __setstate__(self, state):      # also restores pickles made before __slots__
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def __reduce__(self):       # one call with the values, pickles and unpickles several times faster than the state
+        return restore_slotted, (self.__class__, *[getattr(self, key) for key in self.__slots__])
+
+
+def restore_slotted(cls, *values):
+    instance = cls.__new__(cls)
+    for key, value in zip(cls.__slots__, values):
+        setattr(instance, key, value)
+    return instance
+
+
+class Name(Slotted):
+    __slots__ = ('name',)
 
-class Name():
     def __init__(self, name: str) -> None:
         self.name = name
 
@@ -26,7 +101,9 @@ class Name():
         return f'{self.name}'
 
 
-class Address():
+class Address(Slotted):
+    __slots__ = ('address',)
+
     def __init__(self, address: str) -> None:
         self.address = address
 
@@ -34,49 +111,116 @@ class Address():
         return f'{self.address}'
 
 
-class Phone():
+PHONE_PATTERN = re.compile(r'\+[\d]{2}\([\d]{3}\)[\d]{7}')
+NOT_DIGITS = re.compile(r'\D+')
+COUNTRY_CODE = '38'     # of numbers written without one, as in 099 123 45 67
+EMAIL_PATTERN = re.compile(r'[a-zA-Z]{1}[\w\.]+@[a-zA-Z]+\.[a-zA-Z]{2,3}')
+MAX_AGE_DAYS = 100*365
+
+
+class Phone(Slotted):
+    __slots__ = ('phone',)
+
     def __init__(self, phone: str) -> None:
         self.phone = phone
 
     @staticmethod
     def phone_validator(phone: str):
-        if re.fullmatch(r'\+[\d]{2}\([\d]{3}\)[\d]{7}', phone):
+        if PHONE_PATTERN.fullmatch(phone):
             return True
 
     def __str__(self) -> str:
         return f'{self.phone}'
 
 
-class Email():
+def normalize_phone(phone: str) -> str:    # digits with the country code: '+38(099)1234567', '099 123-45-67' -> '380991234567'
+    digits = NOT_DIGITS.sub('', phone)
+    if digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == 10 and digits.startswith('0'):
+        digits = COUNTRY_CODE + digits
+    return digits
+
+
+class Email(Slotted):
+    __slots__ = ('email',)
+
     def __init__(self, email: str) -> None:
         self.email = email
 
     @staticmethod
     def email_validator(email: str):
-        if re.fullmatch(r'[a-zA-Z]{1}[\w\.]+@[a-zA-Z]+\.[a-zA-Z]{2,3}', email):
+        if EMAIL_PATTERN.fullmatch(email):
             return True
 
     def __str__(self) -> str:
         return f'{self.email}'
 
 
-class Birthday():
-    def __init__(self, birthday: str) -> None:
-        self.birthday = datetime.strptime(birthday, '%Y.%m.%d').date()
+class Birthday(Slotted):
+    __slots__ = ('birthday',)
+
+    def __init__(self, birthday: str | date) -> None:
+        if isinstance(birthday, date):
+            self.birthday = birthday
+        else:
+            self.birthday = parse_date(birthday)     # the same parsing as date_validator() and the imports
+            if self.birthday is None:
+                raise ValueError(f"time data {birthday!r} does not match format '%Y.%m.%d'")
 
     @staticmethod
     def date_validator(birthday: str):
-        try:
-            if 100*365 > (datetime.today() - datetime.strptime(birthday, '%Y.%m.%d')).days > 0:
-                return True
-        except:
-            return False
+        return birthday_in_range(parse_date(birthday), date.today())
 
     def __str__(self) -> str:
         return f'{self.birthday}'
 
 
-class Hashtag():
+# Validation of many values at once, for imports and checks of the whole book
+
+
+def parse_date(text: str) -> date | None:      # '%Y.%m.%d' without going through strptime when possible
+    if not isinstance(text, str):
+        return None
+    if (len(text) == 10 and text[4] == '.' and text[7] == '.' and text.isascii()
+            and text[:4].isdigit() and text[5:7].isdigit() and text[8:].isdigit()):    # int() also takes ' 1', '+1'
+        try:
+            return date(int(text[:4]), int(text[5:7]), int(text[8:]))
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(text, '%Y.%m.%d').date()
+    except ValueError:
+        return None
+
+
+def birthday_in_range(birthday: date | None, today: date) -> bool:
+    return birthday is not None and 0 < (today - birthday).days < MAX_AGE_DAYS
+
+
+def validate_phones(phones: list[str]) -> list[bool]:
+    fullmatch = PHONE_PATTERN.fullmatch
+    return [fullmatch(phone) is not None for phone in phones]
+
+
+def validate_emails(emails: list[str]) -> list[bool]:
+    fullmatch = EMAIL_PATTERN.fullmatch
+    return [fullmatch(email) is not None for email in emails]
+
+
+def parse_birthdays(birthdays: list[str], today: date | None = None) -> list[date | None]:
+    if today is None:
+        today = date.today()
+    result = []
+    for birthday in birthdays:
+        day = parse_date(birthday)
+        result.append(day if birthday_in_range(day, today) else None)
+    return result
+
+
+class Hashtag(Slotted):
+    __slots__ = ('hashtag',)
+
     def __init__(self, hashtag: str) -> None:
         self.hashtag = hashtag
 
@@ -84,7 +228,9 @@ class Hashtag():
         return f'{self.hashtag}'
 
 
-class Note():
+class Note(Slotted):
+    __slots__ = ('note',)
+
     def __init__(self, note: str) -> None:
         self.note = note
 
@@ -92,7 +238,27 @@ class Note():
         return f'{self.note}'
 
 
-class Record:
+RENDER_CACHE_SIZE = 1024    # records and notices whose text is kept, as many as SQLiteRecords keeps records
+rendered = OrderedDict()    # Record or Notice -> (fields, *texts) of its last rendering, least recently used first
+
+
+def cached_rendering(owner, fields: tuple) -> tuple | None:     # stale once a field is another object than before
+    cached = rendered.pop(owner, None)
+    if cached is not None and cached[0] == fields:
+        rendered[owner] = cached
+        return cached
+    return None
+
+
+def keep_rendering(owner, rendering: tuple) -> None:
+    rendered[owner] = rendering
+    if len(rendered) > RENDER_CACHE_SIZE:
+        rendered.popitem(last=False)
+
+
+class Record(Slotted):
+    __slots__ = ('name', 'address', 'phones', 'email', 'birthday')
+
     def __init__(self, name: Name, address: Address = None, phone: list[Phone] = None, email: Email = None, birthday: Birthday = None):
         self.name = name
         self.address = address
@@ -125,7 +291,14 @@ class Record:
     def add_birthday(self, birthday: Birthday):
         self.birthday = birthday
 
+    def copy(self) -> 'Record':     # records in a book are never edited in place, changes are made to a copy
+        return Record(self.name, self.address, self.phones, self.email, self.birthday)
+
     def __str__(self) -> str:
+        fields = (self.name, self.address, self.email, self.birthday, *self.phones)
+        cached = cached_rendering(self, fields)
+        if cached is not None:
+            return cached[1]
         record_str = f"Name: {self.name}\n"
 
         if self.address is not None:
@@ -142,12 +315,14 @@ class Record:
         if self.birthday is not None:
             record_str += f"Birthday: {self.birthday}\n"
 
+        keep_rendering(self, (fields, record_str))
         return record_str
 
 class Notice:
     def __init__(self, hashtag: Hashtag, note: Note = None):
 
         self.hashtag = hashtag
+        self._index = None      # NoteIndex of the address book holding this notice
 
         self.notes = []
         if note is not None:
@@ -160,117 +335,1524 @@ class Notice:
         if isinstance(note, str):
             note = self.create_note(note)
         self.notes.append(note)
+        if self._index is not None:
+            self._index.add(note)
 
     def create_note(self, note: str):
         return Note(note)
 
-    def show(self):         # returns notes in nice formating
+    def copy(self) -> 'Notice':
+        notice = Notice(self.hashtag)
+        notice.notes = list(self.notes)
+        return notice
+
+    def _render(self) -> tuple:     # (fields, show(), str())
+        fields = (self.hashtag, *self.notes)
+        cached = cached_rendering(self, fields)
+        if cached is not None:
+            return cached
         if self.notes:
             result = ''
             for inx, n in enumerate(self.notes):
                 result += f' {inx+1}: {n}'
         else:
             result = None
-        return result
+        rendering = fields, result, f'Hashtag: {self.hashtag},\nNotes: {result}\n'
+        keep_rendering(self, rendering)
+        return rendering
+
+    def show(self):         # returns notes in nice formating
+        return self._render()[1]
 
     def __str__(self) -> str:
-        return f'Hashtag: {self.hashtag},\nNotes: {self.show()}\n'
+        return self._render()[2]
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index = None
+
+
+NGRAM = 3
+BULK_INDEX_SIZE = 1000      # pending records re-sorted in one go instead of insort one by one
+
+
+@contextmanager
+def collection_paused():     # bulk work makes millions of objects and no cycles, each allocation burst started a gc run
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def ngrams(text: str) -> set[str]:
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+FEB_29 = 60
+
+
+def day_of_year(day: date) -> int:     # numbered as in a leap year, so Feb 29 always has a slot
+    return (date(2000, day.month, day.day) - date(2000, 1, 1)).days + 1
+
+
+def next_birthday(birthday: date, today: date) -> date:     # today or later, Feb 29 falls on Feb 28 in common years
+    year = today.year
+    while True:
+        if birthday.month == 2 and birthday.day == 29 and not isleap(year):
+            day = date(year, 2, 28)
+        else:
+            day = birthday.replace(year=year)
+        if day >= today:
+            return day
+        year += 1
+
+
+def edit_distance(a: str, b: str) -> int:        # Levenshtein distance
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    def __init__(self) -> None:
+        self.root = None        # (word, {distance: child node})
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def search(self, word: str, tolerance: int) -> list[tuple[int, str]]:
+        result = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= tolerance:
+                result.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - tolerance <= child_distance <= distance + tolerance:
+                    nodes.append(child)
+        return result
+
+
+def fuzzy_tolerance(word: str) -> int:     # edit distance still taken for a typo
+    return 1 if len(word) < 4 else 2 if len(word) < 9 else 3
+
+
+def match_levels(term: str, keys_by_distance: dict[int, list[set]]) -> list[tuple[float, set]]:
+    # (score, keys whose closest word to term is that far), best first; the score of a missing term is 0
+    levels = []
+    seen = set()
+    for distance in sorted(keys_by_distance):
+        score = 1 - distance / len(term)
+        keys = set().union(*keys_by_distance[distance]) - seen
+        if keys and score > 0:
+            levels.append((score, keys))
+            seen |= keys
+    return levels
+
+
+def top_matches(levels: list[list[tuple[float, set]]], count: int, order) -> list[tuple[float, object]]:
+    # (total score, key) of the best count keys by the sum of their per-term scores, ties in book order.
+    # One pass over the matched keys of every term, so the work grows with the matches, not with the terms.
+    scores = {}
+    for term_levels in levels:
+        for score, keys in term_levels:
+            for key in keys:
+                scores[key] = scores.get(key, 0) + score
+    if order is None:
+        best = heapq.nsmallest(count, scores, key=lambda key: (-scores[key], key))
+    else:
+        best = heapq.nsmallest(count, scores, key=lambda key: (-scores[key], order(key)))
+    return [(scores[key], key) for key in best]
+
+
+TOKEN = re.compile(r'\w+')
+WORD = re.compile(r'[^\W\d_]+')      # letters only, so "olena.shevchenko12@ukr.net" gives common words
+FUZZY_TOP = 10
+FUZZY_TERMS = 8     # words of a query looked up, the rest are ignored
+
+
+def fuzzy_terms(query: str) -> list[str]:
+    return list(dict.fromkeys(WORD.findall(query.lower())))[:FUZZY_TERMS]
+
+
+def normalize_hashtag(hashtag: str) -> str:
+    return hashtag.lower().lstrip('#')
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+
+class NoteIndex:
+    def __init__(self) -> None:
+        self.postings = {}      # token -> {note: term frequency}
+        self.tokens = []        # sorted vocabulary, for prefix lookups
+
+    def add(self, note: Note):
+        for token, count in Counter(tokenize(note.note)).items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = {}
+                insort(self.tokens, token)
+            postings[note] = count
+
+    def remove(self, note: Note):
+        for token in set(tokenize(note.note)):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(note, None)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    def _prefix_matches(self, prefix: str) -> dict[Note, int]:
+        result = {}
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            for note, count in self.postings[self.tokens[i]].items():
+                result[note] = result.get(note, 0) + count
+            i += 1
+        return result
+
+    def scores(self, query: str) -> dict[Note, int]:    # every word is a prefix, all of them must match
+        scores = None
+        for term in set(tokenize(query)):
+            matches = self._prefix_matches(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {note: scores[note] + count for note, count in matches.items() if note in scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+    def search(self, query: str) -> list[Note]:     # best scores first
+        scores = self.scores(query)
+        return sorted(scores, key=scores.get, reverse=True)
 
 
 class AddressBook(UserDict):
 
     def __init__(self, record: Record | None = None, notice: Notice | None = None) -> None:
         self.records = {}
+        self.notes = {}
+        self._build_indexes()
+        self._start_history()
+
         if record is not None:
             self.add_record(record)
 
-        self.notes = {}
         if notice is not None:
             self.add_notice(notice)
 
+    # Indexes are derived data: they are not pickled and are rebuilt on load
+    def _build_indexes(self):
+        self._grams = {}            # n-gram -> names of records containing it
+        self._record_texts = {}     # record name -> search text its n-grams were taken from
+        self._order = {}            # record name -> insertion sequence
+        self._sequence = 0
+        self._birthdays = []        # sorted (day of year, record name)
+        self._record_birthday = {}  # record name -> day of year
+        self._phones = {}           # normalize_phone() key -> names of records with that number
+        self._words = {}            # word of a name, email or address -> names of records with it
+        self._word_tree = BKTree()  # the words, for fuzzy_search(); removed words stay but have no records
+        self._record_words = {}     # record name -> words it was indexed under
+        self._record_phones = {}    # record name -> phone keys it was indexed under
+        self._unindexed = {}        # records added since the last query, indexed in bulk by _catch_up()
+        for name, record in self.records.items():
+            self._sequence += 1
+            self._order[name] = self._sequence
+            self._unindexed[name] = record
+        self._note_index = NoteIndex()
+        for notice in self.notes.values():
+            self._index_notice(notice)
+        self._sorted_hashtags = sorted(self.notes)  # hashtags in sort_notes() order
+        self._hashtags = sorted((normalize_hashtag(key), key) for key in self.notes)
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_indexes()
+        self._start_history()
+
+    # Every change is (kind, key, old value, new value), None standing for "absent". Stored records and notices
+    # are never changed in place, so the old values stay valid and a snapshot is just a version number.
+    def _start_history(self):
+        self._version = 0
+        self._group = None          # changes of the running command
+        self._undo = deque(maxlen=UNDO_LIMIT)
+        self._redo = []
+        self._snapshots = WeakSet()
+        self._key_log = {}          # (kind, key) -> [(version, value before that version)], while snapshots exist
+        self._watchers = []         # called with every change as it is made, e.g. by BirthdayReminders
+
+    def _tracking(self) -> bool:    # whether old values are needed at all
+        return self._group is not None or bool(self._snapshots)
+
+    def _changed(self, kind: str, key: str, old, new):
+        self._version += 1
+        if self._group is not None:
+            self._group.append((kind, key, old, new))
+        if self._snapshots:
+            self._key_log.setdefault((kind, key), []).append((self._version, old))
+        for watcher in self._watchers:
+            watcher(kind, key, new)
+
+    @contextmanager
+    def changes(self):      # everything changed inside is one step for undo()
+        self._group = []
+        try:
+            yield
+        finally:
+            group, self._group = self._group, None
+            if group:
+                self._undo.append(group)
+                self._redo = []
+
+    @contextmanager
+    def bulk_changes(self):     # too many changes to keep for undo(), the older steps are dropped as well
+        try:
+            yield
+        finally:
+            self._undo.clear()
+            self._redo = []
+
+    def _revert(self, group: list) -> list:     # puts back the old values, returns the changes that made
+        outer, self._group = self._group, []
+        try:
+            for kind, key, old, new in reversed(group):
+                if kind == 'records':
+                    if old is None:
+                        self.remove_record(key)
+                    else:
+                        self.add_record(old)
+                elif old is None:
+                    self.remove_notice(key)
+                else:
+                    self.add_notice(old)
+            return self._group
+        finally:
+            self._group = outer
+
+    def undo(self) -> list | None:
+        if not self._undo:
+            return None
+        group = self._revert(self._undo.pop())
+        self._redo.append(group)
+        return group
+
+    def redo(self) -> list | None:
+        if not self._redo:
+            return None
+        group = self._revert(self._redo.pop())
+        self._undo.append(group)
+        return group
+
+    def snapshot(self) -> 'BookSnapshot':      # O(1), later changes are not visible through it
+        if not self._snapshots:
+            self._key_log = {}
+        snapshot = BookSnapshot(self, self._version)
+        self._snapshots.add(snapshot)
+        return snapshot
+
+    def _value_at(self, kind: str, key: str, version: int):
+        log = self._key_log.get((kind, key))
+        if log:
+            i = bisect_left(log, version + 1, key=lambda entry: entry[0])
+            if i < len(log):
+                return log[i][1]
+        return getattr(self, kind).get(key)
+
+    @staticmethod
+    def _search_fields(record: Record) -> list[str]:
+        fields = [str(record.name).lower()]
+        for field in (record.address, record.email, record.birthday):
+            if field is not None:
+                fields.append(str(field).lower())
+        fields.extend(str(phone).lower() for phone in record.phones)
+        return fields
+
+    @staticmethod
+    def _fuzzy_words(record: Record) -> set[str]:
+        fields = (record.name, record.email, record.address)
+        return set(WORD.findall(' '.join(str(field) for field in fields if field is not None).lower()))
+
+    def _index_record(self, name: str, record: Record, bulk: bool = False):
+        text = '\n'.join(self._search_fields(record))      # grams across two fields match no query
+        for gram in ngrams(text):
+            names = self._grams.get(gram)
+            if names is None:
+                self._grams[gram] = {name}
+            else:
+                names.add(name)
+        self._record_texts[name] = text     # one string instead of a set of grams for every record
+        if record.birthday is not None:
+            day = day_of_year(record.birthday.birthday)
+            if bulk:
+                self._birthdays.append((day, name))
+            else:
+                insort(self._birthdays, (day, name))
+            self._record_birthday[name] = day
+        keys = {normalize_phone(phone.phone) for phone in record.phones}
+        for key in keys:
+            self._phones.setdefault(key, []).append(name)
+        if keys:
+            self._record_phones[name] = keys
+        words = self._fuzzy_words(record)
+        for word in words:
+            names = self._words.get(word)
+            if names is None:
+                names = self._words[word] = set()
+                self._word_tree.add(word)
+            names.add(name)
+        self._record_words[name] = words
+
+    def _unindex_record(self, name: str, record: Record):
+        if self._unindexed.pop(name, None) is not None:
+            return
+        for word in self._record_words.pop(name, ()):
+            names = self._words[word]
+            names.discard(name)
+            if not names:
+                del self._words[word]
+        for gram in ngrams(self._record_texts.pop(name, '')):
+            postings = self._grams[gram]
+            postings.discard(name)
+            if not postings:
+                del self._grams[gram]
+        day = self._record_birthday.pop(name, None)
+        if day is not None:
+            del self._birthdays[bisect_left(self._birthdays, (day, name))]
+        for key in self._record_phones.pop(name, ()):
+            names = self._phones[key]
+            names.remove(name)
+            if not names:
+                del self._phones[key]
+
+    def _catch_up(self):
+        if not self._unindexed:
+            return
+        bulk = len(self._unindexed) > BULK_INDEX_SIZE
+        with collection_paused() if bulk else nullcontext():
+            for name, record in self._unindexed.items():
+                self._index_record(name, record, bulk)
+        if bulk:
+            self._birthdays.sort()
+        self._unindexed = {}
+
     def add_record(self, record: Record):
-        self.records[record.name.name] = record
+        name = record.name.name
+        old = self.records.get(name)
+        if old is not None:
+            self._unindex_record(name, old)
+        else:
+            self._sequence += 1
+            self._order[name] = self._sequence
+        self.records[name] = record
+        self._unindexed[name] = record
+        self._changed('records', name, old, record)
+
+    def update_record(self, record: Record, old_name: str | None = None):
+        if old_name is not None and old_name != record.name.name:
+            self.remove_record(old_name)
+        self.add_record(record)
+
+    def remove_record(self, name: str):
+        old = self.records.pop(name, None)
+        if old is not None:
+            self._unindex_record(name, old)
+            del self._order[name]
+            self._changed('records', name, old, None)
+
+    def find_record(self, name: str) -> Record | None:     # exact name first, then ignoring case
+        record = self.records.get(name)
+        if record is None:
+            name = name.lower()
+            record = next((record for key, record in self.records.items() if key.lower() == name), None)
+        return record
+
+    def validate(self) -> list[tuple[str, str, str]]:     # (contact, field, value) breaking the current rules
+        today = date.today()
+        phones = [(name, phone.phone) for name, record in self.records.items() for phone in record.phones]
+        emails = [(name, record.email.email) for name, record in self.records.items() if record.email is not None]
+        problems = [(name, 'phone', phone) for (name, phone), valid
+                    in zip(phones, validate_phones([phone for _, phone in phones])) if not valid]
+        problems += [(name, 'email', email) for (name, email), valid
+                     in zip(emails, validate_emails([email for _, email in emails])) if not valid]
+        problems += [(name, 'birthday', str(record.birthday)) for name, record in self.records.items()
+                     if record.birthday is not None and not birthday_in_range(record.birthday.birthday, today)]
+        return problems
+
+    def search_records(self, query: str) -> list[Record]:
+        self._catch_up()
+        query = query.lower()
+        if len(query) < NGRAM:
+            names = self.records
+        else:
+            postings = sorted((self._grams.get(gram, set()) for gram in ngrams(query)), key=len)
+            names = sorted(postings[0].intersection(*postings[1:]), key=self._order.get)
+        result = []
+        for name in names:
+            record = self.records[name]
+            if any(query in field for field in self._search_fields(record)):
+                result.append(record)
+        return result
+
+    def fuzzy_search(self, query: str, count: int = FUZZY_TOP) -> list[Record]:    # best matches, typos allowed
+        return [self.records[name] for _, name in self._fuzzy_matches(query, count)]
+
+    def _fuzzy_matches(self, query: str, count: int) -> list[tuple[float, str]]:
+        self._catch_up()
+        levels = []
+        for term in fuzzy_terms(query):
+            keys_by_distance = {}
+            for distance, word in self._word_tree.search(term, fuzzy_tolerance(term)):
+                names = self._words.get(word)
+                if names:
+                    keys_by_distance.setdefault(distance, []).append(names)
+            levels.append(match_levels(term, keys_by_distance))
+        return top_matches(levels, count, self._order.get)
+
+    def who_calls(self, phone: str) -> list[Record]:     # contacts having this number, written in any way
+        self._catch_up()
+        return [self.records[name] for name in self._phones.get(normalize_phone(phone), ())]
+
+    def _index_notice(self, notice: Notice):
+        notice._index = self._note_index
+        for note in notice.notes:
+            self._note_index.add(note)
+
+    def _unindex_notice(self, notice: Notice):
+        notice._index = None
+        for note in notice.notes:
+            self._note_index.remove(note)
 
     def add_notice(self, notice: Notice):
-        self.notes[notice.hashtag.hashtag] = notice
+        key = notice.hashtag.hashtag
+        normalized = normalize_hashtag(key)     # fails on a bad hashtag before any index is touched
+        old_notice = self.notes.get(key)
+        if old_notice is not None:
+            self._unindex_notice(old_notice)
+        else:
+            insort(self._sorted_hashtags, key)
+            insort(self._hashtags, (normalized, key))
+        self.notes[key] = notice
+        self._index_notice(notice)
+        self._changed('notes', key, old_notice, notice)
+
+    def remove_notice(self, key: str):
+        notice = self.notes.pop(key, None)
+        if notice is not None:
+            self._unindex_notice(notice)
+            del self._sorted_hashtags[bisect_left(self._sorted_hashtags, key)]
+            del self._hashtags[bisect_left(self._hashtags, (normalize_hashtag(key), key))]
+            self._changed('notes', key, notice, None)
+
+    def _birthdays_between(self, first: int, last: int) -> list[Record]:
+        start = bisect_left(self._birthdays, (first, ''))
+        end = bisect_left(self._birthdays, (last + 1, ''))
+        return [self.records[name] for _, name in self._birthdays[start:end]]
+
+    def upcoming_birthdays(self, days: int, today: date | None = None) -> list[Record]:
+        self._catch_up()
+        if today is None:
+            today = date.today()
+        if days < 0:
+            return []
+        first = day_of_year(today)
+        if days >= 365:
+            return self._birthdays_between(first, 366) + self._birthdays_between(1, first - 1)
+        last_day = today + timedelta(days=days)
+        last = day_of_year(last_day)
+        if last == FEB_29 - 1 and not isleap(last_day.year):
+            last = FEB_29       # Feb 29 birthdays are celebrated on Feb 28 in common years
+        if last_day.year == today.year:
+            return self._birthdays_between(first, last)
+        return self._birthdays_between(first, 366) + self._birthdays_between(1, last)
 
     def note_searcher(self, keyword: str):
-        result = []
-        for notice in self.notes.values():
-            for note in notice.notes:
-                if keyword.lower() in note.note.lower():
-                    result.append(note)
-        return result
+        return self._note_index.search(keyword)
 
-    def hashtag_searcher(self, keyword: str):
+    def hashtag_searcher(self, keyword: str):      # hashtags starting with keyword, '#' is optional
+        prefix = normalize_hashtag(keyword)
         result = []
-        for notice in self.notes.values():
-            if keyword.lower() in notice.hashtag.hashtag.lower():
-                result.append(notice)
+        i = bisect_left(self._hashtags, (prefix, ''))
+        while i < len(self._hashtags) and self._hashtags[i][0].startswith(prefix):
+            result.append(self.notes[self._hashtags[i][1]])
+            i += 1
         return result
 
     def sort_notes(self):
-        sorted_notes = sorted(self.notes.values(),
-                              key=lambda notice: str(notice.hashtag))
-        return sorted_notes
-
-    def iterator(self, N, essence):
-        counter = 0
-        result = f'\nPrinting {N} contacts'
-        for item, record in essence.items():
-            result += f'\n{str(record)}'
-            counter += 1
-            if counter >= N:
-                yield result
-                counter = 0
-                result = f'\nPrinting next {N} contacts'
+        return [self.notes[key] for key in self._sorted_hashtags]
+
+    def iterator(self, N, essence, start=0):       # yields (offset after the page, rendered page)
+        items = islice(essence.values(), start, None)
+        offset = start
+        while True:
+            page = list(islice(items, N))
+            if not page:
+                return
+            offset += len(page)
+            yield offset, '\n'.join(str(item) for item in page)
 
     def __str__(self) -> str:
         return '\n'.join(str(record) for record in self.records.values())
 
-    def __deepcopy__(self, memodict={}):
-        copy_ab = AddressBook(self, self.records, self.notes)
-        memodict[id(self)] = copy_ab
-        for el in self.records:
-            copy_ab.append(deepcopy(el, memodict))
-        for el in self.notes:
-            copy_ab.append(deepcopy(el, memodict))
-        return copy_ab
+
+UNDO_LIMIT = 100        # commands that can be undone
+
+
+class SnapshotView(Mapping):       # records or notes of a book as they were at one version
+    def __init__(self, book: AddressBook, kind: str, version: int) -> None:
+        self.book = book
+        self.kind = kind
+        self.version = version
+
+    def __getitem__(self, key: str):
+        value = self.book._value_at(self.kind, key, self.version)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):     # present keys in the book's order, then the ones removed since
+        changed = [key for kind, key in self.book._key_log if kind == self.kind]
+        for key in list(getattr(self.book, self.kind)):
+            if key in self:
+                yield key
+        for key in changed:
+            if key not in getattr(self.book, self.kind) and key in self:
+                yield key
+
+    def __contains__(self, key) -> bool:
+        return self.book._value_at(self.kind, key, self.version) is not None
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class BookSnapshot:     # a consistent read-only view of the book, writes can go on meanwhile
+    def __init__(self, book: AddressBook, version: int) -> None:
+        self.version = version
+        self.records = SnapshotView(book, 'records', version)
+        self.notes = SnapshotView(book, 'notes', version)
+
+    def __str__(self) -> str:
+        return '\n'.join(str(record) for record in self.records.values())
 
 
 address_book = AddressBook()
 
 
+# Instrumentation
+
+
+class LatencyStats:
+    BUCKET_GROWTH = 1.1         # each histogram bucket is 10% wider than the previous one
+    SMALLEST = 1e-6             # upper bound of the first bucket, in seconds
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.histograms = {}    # name -> {bucket: calls}
+        self.totals = {}        # name -> (calls, total seconds, max seconds)
+
+    def add(self, name: str, seconds: float) -> None:
+        bucket = max(0, math.ceil(math.log(max(seconds, self.SMALLEST) / self.SMALLEST, self.BUCKET_GROWTH)))
+        histogram = self.histograms.setdefault(name, {})
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        calls, total, longest = self.totals.get(name, (0, 0.0, 0.0))
+        self.totals[name] = (calls + 1, total + seconds, max(longest, seconds))
+
+    def percentile(self, name: str, percent: float) -> float:
+        histogram = self.histograms[name]
+        wanted = percent / 100 * self.totals[name][0]
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= wanted:
+                return min(self.SMALLEST * self.BUCKET_GROWTH ** bucket, self.totals[name][2])
+        return self.totals[name][2]
+
+    def summary(self) -> dict[str, dict]:
+        result = {}
+        for name, (calls, total, longest) in sorted(self.totals.items()):
+            result[name] = {'calls': calls, 'mean': total / calls, 'p50': self.percentile(name, 50),
+                            'p95': self.percentile(name, 95), 'p99': self.percentile(name, 99), 'max': longest}
+        return result
+
+    def export(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+stats = LatencyStats()
+
+
+def timed(name: str):       # costs one attribute check per call while instrumentation is off
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# Persistence
+
+
+BACKUP_FILE = 'backup.dat'
+JOURNAL_FILE = 'backup.journal'
+JOURNAL_LIMIT = 1000        # min journal entries before the snapshot is rewritten
+
+
+class Journal:
+    def __init__(self, path: str | None) -> None:
+        self.path = path    # None if the storage saves changes itself, then they are only counted
+        self.pending = []   # changes made since the last save
+        self.unsaved = 0    # how many, also counted when they are not kept
+        self.size = 0       # entries already written to the journal file
+
+    def log(self, action: str, *args) -> None:
+        self.unsaved += 1
+        if self.path is not None:
+            self.pending.append((action, *args))
+
+    def flush(self) -> None:
+        import pickle
+        with open(self.path, 'ab') as file:
+            for entry in self.pending:
+                pickle.dump(entry, file)
+            file.flush()
+            os.fsync(file.fileno())
+        self.size += len(self.pending)
+        self.pending = []
+        self.unsaved = 0
+
+    def replay(self, book: AddressBook) -> None:
+        import pickle
+        self.pending = []
+        self.unsaved = 0
+        self.size = 0
+        try:
+            file = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return
+        with file:
+            while True:
+                offset = file.tell()
+                try:
+                    action, *args = pickle.load(file)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError):
+                    file.truncate(offset)   # torn tail of an interrupted save
+                    break
+                getattr(book, action)(*args)
+                self.size += 1
+
+    def clear(self) -> None:
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.pending = []
+        self.unsaved = 0
+        self.size = 0
+
+    def needs_compaction(self, book: AddressBook) -> bool:
+        limit = max(JOURNAL_LIMIT, len(book.records) // 4)
+        return self.size + self.unsaved > limit
+
+
+class Storage(ABC):
+    def __init__(self, path: str, journal: Journal) -> None:
+        self.path = path
+        self.journal = journal      # changes made since the last save
+
+    def __str__(self) -> str:      # where the book is kept, for messages
+        return self.path
+
+    def exists(self) -> bool:      # whether a book was saved before
+        return os.path.exists(self.path)
+
+    @abstractmethod
+    def load(self) -> AddressBook | None:      # None if nothing was saved yet
+        pass
+
+    @abstractmethod
+    def save(self, book: AddressBook) -> None:
+        pass
+
+
+def write_atomically(path: str, data: bytes) -> None:     # the file is either the old or the new one, never torn
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+COMPRESSIONS = {b'\x78': 'zlib', b'\xfd7zXZ\x00': 'lzma'}    # magic bytes of compressed snapshots
+
+
+class PickleStorage(Storage):      # the whole book in one snapshot, later changes appended to the journal
+    def __init__(self, path: str, journal: Journal, compression: str | None = None) -> None:
+        super().__init__(path, journal)
+        self.compression = compression      # 'zlib' or 'lzma' for new snapshots, any kind is read
+
+    def load(self) -> AddressBook | None:
+        import pickle
+        try:
+            with open(self.path, 'rb') as file:
+                head = file.read(6)
+                file.seek(0)
+                compression = next((name for magic, name in COMPRESSIONS.items() if head.startswith(magic)), None)
+                if compression is None:
+                    book = pickle.load(file)
+                else:
+                    book = pickle.loads(import_module(compression).decompress(file.read()))
+        except Exception:
+            return None
+        self.journal.replay(book)
+        return book
+
+    def save(self, book: AddressBook) -> None:
+        import pickle
+        if not os.path.exists(self.path) or self.journal.needs_compaction(book):
+            data = pickle.dumps(book)
+            if self.compression is not None:
+                data = import_module(self.compression).compress(data)
+            write_atomically(self.path, data)
+            self.journal.clear()
+        elif self.journal.unsaved:
+            self.journal.flush()
+
+
+DATABASE_FILE = 'book.db'
+RECORD_CACHE_SIZE = 1024    # records kept in memory by SQLiteRecords
+LOAD_BATCH = 500            # records read at once when the whole table is walked
+LAST_CHAR = chr(0x10ffff)   # prefix + LAST_CHAR is above every string starting with prefix
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, name_lower TEXT NOT NULL,
+    address TEXT, email TEXT, birthday TEXT, birthday_day INTEGER);
+CREATE INDEX IF NOT EXISTS records_name_lower ON records (name_lower);
+CREATE INDEX IF NOT EXISTS records_email ON records (email);
+CREATE INDEX IF NOT EXISTS records_birthday_day ON records (birthday_day, name);
+CREATE TABLE IF NOT EXISTS phones (record_id INTEGER NOT NULL, position INTEGER NOT NULL, phone TEXT NOT NULL,
+                                   phone_key TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS phones_record ON phones (record_id, position);
+CREATE INDEX IF NOT EXISTS phones_phone_key ON phones (phone_key);
+CREATE TABLE IF NOT EXISTS record_words (word TEXT NOT NULL, record_id INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS record_words_word ON record_words (word);
+CREATE INDEX IF NOT EXISTS record_words_record ON record_words (record_id);
+CREATE TABLE IF NOT EXISTS notices (id INTEGER PRIMARY KEY, hashtag TEXT NOT NULL UNIQUE, hashtag_key TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS notices_hashtag_key ON notices (hashtag_key, hashtag);
+CREATE TABLE IF NOT EXISTS notes (id INTEGER PRIMARY KEY, notice_id INTEGER NOT NULL, position INTEGER NOT NULL,
+                                  note TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS notes_notice ON notes (notice_id, position);
+CREATE TABLE IF NOT EXISTS note_tokens (token TEXT NOT NULL, note_id INTEGER NOT NULL, count INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS note_tokens_token ON note_tokens (token);
+CREATE INDEX IF NOT EXISTS note_tokens_note ON note_tokens (note_id);
+'''
+
+
+class SQLiteRecords(Mapping):      # records of an SQLiteAddressBook, read from the database on demand
+    def __init__(self, book: 'SQLiteAddressBook') -> None:
+        self.book = book
+        self.cache = OrderedDict()      # name -> Record, least recently used first
+
+    def __getitem__(self, name: str) -> Record:
+        record = self.cache.get(name)
+        if record is not None:
+            self.cache.move_to_end(name)
+            return record
+        records = self.book._load_records('WHERE name = ?', (name,))
+        if not records:
+            raise KeyError(name)
+        return records[0]
+
+    def __contains__(self, name) -> bool:
+        return name in self.cache or self.book._query('SELECT 1 FROM records WHERE name = ?', (name,)).fetchone() is not None
+
+    def __iter__(self):
+        return (name for name, in self.book._query('SELECT name FROM records ORDER BY id').fetchall())
+
+    def __len__(self) -> int:
+        return self.book._query('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def values(self):       # streamed in batches, in insertion order
+        last_id = 0
+        while True:
+            records = self.book._load_records('WHERE id > ? ORDER BY id LIMIT ?', (last_id, LOAD_BATCH), with_ids=True)
+            if not records:
+                return
+            for last_id, record in records:
+                yield record
+
+    def items(self):
+        return ((record.name.name, record) for record in self.values())
+
+    def remember(self, record: Record) -> None:
+        self.cache[record.name.name] = record
+        self.cache.move_to_end(record.name.name)
+        if len(self.cache) > RECORD_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def forget(self, name: str) -> None:
+        self.cache.pop(name, None)
+
+
+class SQLiteNotes:      # takes the place of NoteIndex for a notice stored in the database
+    def __init__(self, book: 'SQLiteAddressBook', notice_id: int) -> None:
+        self.book = book
+        self.notice_id = notice_id
+
+    def add(self, note: Note) -> None:
+        self.book._insert_note(self.notice_id, note)
+
+
+class SQLiteNotices(Mapping):
+    def __init__(self, book: 'SQLiteAddressBook') -> None:
+        self.book = book
+
+    def __getitem__(self, hashtag: str) -> Notice:
+        row = self.book._query('SELECT id FROM notices WHERE hashtag = ?', (hashtag,)).fetchone()
+        if row is None:
+            raise KeyError(hashtag)
+        notice = Notice(Hashtag(hashtag))
+        notice.notes = [Note(note) for note, in self.book._query(
+            'SELECT note FROM notes WHERE notice_id = ? ORDER BY position', row)]
+        notice._index = SQLiteNotes(self.book, row[0])
+        return notice
+
+    def __contains__(self, hashtag) -> bool:
+        return self.book._query('SELECT 1 FROM notices WHERE hashtag = ?', (hashtag,)).fetchone() is not None
+
+    def __iter__(self):
+        return (hashtag for hashtag, in self.book._query('SELECT hashtag FROM notices ORDER BY id').fetchall())
+
+    def __len__(self) -> int:
+        return self.book._query('SELECT COUNT(*) FROM notices').fetchone()[0]
+
+
+class SQLiteAddressBook(AddressBook):
+    # Same interface as AddressBook, but records and notes stay in the database and the indexes are SQLite's.
+    # Changes are written at once inside a transaction, save commits it.
+
+    def __init__(self, connection: 'sqlite3.Connection') -> None:
+        import sqlite3
+        self.connection = connection
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS record_search USING fts5(text, tokenize='trigram')")
+            self.full_text = True
+        except sqlite3.OperationalError:    # SQLite before 3.34 or without FTS5: substring scan over one table
+            self.connection.execute('CREATE TABLE IF NOT EXISTS record_search (rowid INTEGER PRIMARY KEY, text TEXT)')
+            self.full_text = False
+        self.connection.commit()
+        self.records = SQLiteRecords(self)
+        self.notes = SQLiteNotices(self)
+        self._start_history()
+        self._word_tree = None      # built from record_words by the first fuzzy_search()
+
+    def _query(self, sql: str, parameters=()) -> 'sqlite3.Cursor':
+        return self.connection.execute(sql, parameters)
+
+    def _load_records(self, condition: str, parameters=(), with_ids: bool = False) -> list:
+        rows = self._query(f'SELECT id, name, address, email, birthday FROM records {condition}', parameters).fetchall()
+        if not rows:
+            return []
+        phones = {}
+        ids = [row[0] for row in rows]
+        for start in range(0, len(ids), LOAD_BATCH):     # a search may hit more rows than SQLite takes variables
+            batch = ids[start:start + LOAD_BATCH]
+            for record_id, phone in self._query(f'SELECT record_id, phone FROM phones WHERE record_id IN '
+                                                f'({",".join("?" * len(batch))}) ORDER BY record_id, position', batch):
+                phones.setdefault(record_id, []).append(Phone(phone))
+        result = []
+        for record_id, name, address, email, birthday in rows:
+            record = self.records.cache.get(name)
+            if record is None:
+                record = Record(Name(name),
+                                Address(address) if address is not None else None,
+                                phones.get(record_id),
+                                Email(email) if email is not None else None,
+                                Birthday(date.fromisoformat(birthday)) if birthday is not None else None)
+            self.records.remember(record)
+            result.append((record_id, record) if with_ids else record)
+        return result
+
+    def add_record(self, record: Record):
+        name = record.name.name
+        old = self.records.get(name) if self._tracking() else None
+        birthday = record.birthday.birthday if record.birthday is not None else None
+        values = (name.lower(),
+                  record.address.address if record.address is not None else None,
+                  record.email.email if record.email is not None else None,
+                  birthday.isoformat() if birthday is not None else None,
+                  day_of_year(birthday) if birthday is not None else None)
+        row = self._query('SELECT id FROM records WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            record_id = self._query('INSERT INTO records (name, name_lower, address, email, birthday, birthday_day) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', (name, *values)).lastrowid
+        else:
+            record_id = row[0]
+            self._query('UPDATE records SET name_lower = ?, address = ?, email = ?, birthday = ?, birthday_day = ? '
+                        'WHERE id = ?', (*values, record_id))
+            self._query('DELETE FROM phones WHERE record_id = ?', (record_id,))
+            self._query('DELETE FROM record_words WHERE record_id = ?', (record_id,))
+            self._query('DELETE FROM record_search WHERE rowid = ?', (record_id,))
+        self.connection.executemany('INSERT INTO phones (record_id, position, phone, phone_key) VALUES (?, ?, ?, ?)',
+                                    [(record_id, i, phone.phone, normalize_phone(phone.phone))
+                                     for i, phone in enumerate(record.phones)])
+        self._query('INSERT INTO record_search (rowid, text) VALUES (?, ?)',
+                    (record_id, '\n'.join(self._search_fields(record))))
+        words = self._fuzzy_words(record)
+        self.connection.executemany('INSERT INTO record_words (word, record_id) VALUES (?, ?)',
+                                    [(word, record_id) for word in words])
+        if self._word_tree is not None:
+            for word in words:
+                self._word_tree.add(word)
+        self.records.remember(record)
+        self._changed('records', name, old, record)
+
+    def remove_record(self, name: str):
+        old = self.records.get(name) if self._tracking() else None
+        self.records.forget(name)
+        row = self._query('SELECT id FROM records WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            self._query('DELETE FROM records WHERE id = ?', row)
+            self._query('DELETE FROM phones WHERE record_id = ?', row)
+            self._query('DELETE FROM record_words WHERE record_id = ?', row)
+            self._query('DELETE FROM record_search WHERE rowid = ?', row)
+            self._changed('records', name, old, None)
+
+    def update_record(self, record: Record, old_name: str | None = None):
+        if old_name is not None and old_name != record.name.name:
+            self.remove_record(old_name)
+        self.add_record(record)
+
+    def find_record(self, name: str) -> Record | None:
+        if name in self.records:
+            return self.records[name]
+        records = self._load_records('WHERE name_lower = ? ORDER BY id LIMIT 1', (name.lower(),))
+        return records[0] if records else None
+
+    def search_records(self, query: str) -> list[Record]:
+        query = query.lower()
+        if self.full_text and len(query) >= NGRAM:
+            condition = 'WHERE id IN (SELECT rowid FROM record_search WHERE record_search MATCH ?) ORDER BY id'
+            parameter = '"' + query.replace('"', '""') + '"'
+        else:
+            condition = 'WHERE id IN (SELECT rowid FROM record_search WHERE instr(text, ?) > 0) ORDER BY id'
+            parameter = query
+        return [record for record in self._load_records(condition, (parameter,))
+                if any(query in field for field in self._search_fields(record))]
+
+    def _catch_up(self):
+        pass
+
+    def fuzzy_search(self, query: str, count: int = FUZZY_TOP) -> list[Record]:
+        if self._word_tree is None:
+            self._word_tree = BKTree()
+            for word, in self._query('SELECT DISTINCT word FROM record_words').fetchall():
+                self._word_tree.add(word)
+        levels = []
+        for term in fuzzy_terms(query):
+            words_by_distance = {}
+            for distance, word in self._word_tree.search(term, fuzzy_tolerance(term)):
+                words_by_distance.setdefault(distance, []).append(word)
+            keys_by_distance = {}
+            for distance, words in words_by_distance.items():
+                for start in range(0, len(words), LOAD_BATCH):
+                    batch = words[start:start + LOAD_BATCH]
+                    keys_by_distance.setdefault(distance, []).append({record_id for record_id, in self._query(
+                        f'SELECT record_id FROM record_words WHERE word IN ({",".join("?" * len(batch))})', batch)})
+            levels.append(match_levels(term, keys_by_distance))
+        top = [record_id for _, record_id in top_matches(levels, count, None)]
+        if not top:
+            return []
+        records = dict(self._load_records(f'WHERE id IN ({",".join("?" * len(top))})', top, with_ids=True))
+        return [records[record_id] for record_id in top]
+
+    def who_calls(self, phone: str) -> list[Record]:
+        return self._load_records('WHERE id IN (SELECT record_id FROM phones WHERE phone_key = ?) ORDER BY id',
+                                  (normalize_phone(phone),))
+
+    def _birthdays_between(self, first: int, last: int) -> list[Record]:     # one query for the whole range
+        return self._load_records('WHERE birthday_day BETWEEN ? AND ? ORDER BY birthday_day, name', (first, last))
+
+    def _insert_note(self, notice_id: int, note: Note) -> None:
+        position = self._query('SELECT COUNT(*) FROM notes WHERE notice_id = ?', (notice_id,)).fetchone()[0]
+        note_id = self._query('INSERT INTO notes (notice_id, position, note) VALUES (?, ?, ?)',
+                              (notice_id, position, note.note)).lastrowid
+        self.connection.executemany('INSERT INTO note_tokens (token, note_id, count) VALUES (?, ?, ?)',
+                                    [(token, note_id, count) for token, count in Counter(tokenize(note.note)).items()])
+
+    def add_notice(self, notice: Notice):
+        key = notice.hashtag.hashtag
+        old = self.notes.get(key) if self._tracking() else None
+        row = self._query('SELECT id FROM notices WHERE hashtag = ?', (key,)).fetchone()
+        if row is None:
+            notice_id = self._query('INSERT INTO notices (hashtag, hashtag_key) VALUES (?, ?)',
+                                    (key, normalize_hashtag(key))).lastrowid
+        else:
+            notice_id = row[0]
+            self._query('DELETE FROM note_tokens WHERE note_id IN (SELECT id FROM notes WHERE notice_id = ?)', row)
+            self._query('DELETE FROM notes WHERE notice_id = ?', row)
+        for note in notice.notes:
+            self._insert_note(notice_id, note)
+        notice._index = SQLiteNotes(self, notice_id)
+        self._changed('notes', key, old, notice)
+
+    def remove_notice(self, key: str):
+        old = self.notes.get(key) if self._tracking() else None
+        row = self._query('SELECT id FROM notices WHERE hashtag = ?', (key,)).fetchone()
+        if row is not None:
+            self._query('DELETE FROM note_tokens WHERE note_id IN (SELECT id FROM notes WHERE notice_id = ?)', row)
+            self._query('DELETE FROM notes WHERE notice_id = ?', row)
+            self._query('DELETE FROM notices WHERE id = ?', row)
+            self._changed('notes', key, old, None)
+
+    def note_searcher(self, keyword: str):     # the same prefix AND search as NoteIndex, over note_tokens
+        scores = None
+        for term in set(tokenize(keyword)):
+            matches = dict(self._query('SELECT note_id, SUM(count) FROM note_tokens WHERE token >= ? AND token < ? '
+                                       'GROUP BY note_id', (term, term + LAST_CHAR)))
+            if scores is None:
+                scores = matches
+            else:
+                scores = {note_id: scores[note_id] + count for note_id, count in matches.items() if note_id in scores}
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        ids = sorted(scores, key=lambda note_id: (-scores[note_id], note_id))
+        notes = {}
+        for start in range(0, len(ids), LOAD_BATCH):
+            batch = ids[start:start + LOAD_BATCH]
+            notes.update(self._query(f'SELECT id, note FROM notes WHERE id IN ({",".join("?" * len(batch))})', batch))
+        return [Note(notes[note_id]) for note_id in ids]
+
+    def hashtag_searcher(self, keyword: str):
+        prefix = normalize_hashtag(keyword)
+        return [self.notes[hashtag] for hashtag, in self._query(
+            'SELECT hashtag FROM notices WHERE hashtag_key >= ? AND hashtag_key < ? ORDER BY hashtag_key, hashtag',
+            (prefix, prefix + LAST_CHAR)).fetchall()]
+
+    def sort_notes(self):
+        return [self.notes[hashtag] for hashtag, in self._query('SELECT hashtag FROM notices ORDER BY hashtag').fetchall()]
+
+
+class SQLiteStorage(Storage):      # nothing is read up front, unsaved changes are rolled back on exit
+    def __init__(self, path: str, journal: Journal) -> None:
+        super().__init__(path, journal)
+        self.connection = None
+
+    def load(self) -> AddressBook | None:
+        if self.connection is None:
+            import sqlite3
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)   # may be opened by BackgroundLoader
+        else:
+            self.connection.rollback()
+        self.journal.clear()
+        return SQLiteAddressBook(self.connection)
+
+    def save(self, book: AddressBook) -> None:
+        book.connection.commit()
+        self.journal.clear()
+
+
+SHARD_FILE = 'backup.{}.dat'        # snapshot and journal of each shard of a sharded book
+SHARD_JOURNAL = 'backup.{}.journal'
+SHARD_MANIFEST = 'backup.shards'    # the number of shards, keys can only be found with the same one
+
+
+def shard_of(key: str, count: int) -> int:
+    from zlib import crc32
+    return crc32(key.encode()) % count
+
+
+class BookShard(AddressBook):      # one part of a ShardedAddressBook, kept by its own worker process
+    def __init__(self) -> None:
+        self.places = {'records': {}, 'notes': {}}     # key -> place in the whole book, results are merged on it
+        super().__init__()
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if 'places' not in state:       # saved before places were kept: the shard's own order
+            self.places = {kind: {key: place for place, key in enumerate(getattr(self, kind))}
+                           for kind in ('records', 'notes')}
+
+    def add_record(self, record: Record, place: int = 0):
+        self.places['records'].setdefault(record.name.name, place)     # a replaced record keeps its place
+        super().add_record(record)
+
+    def remove_record(self, name: str):
+        self.places['records'].pop(name, None)
+        super().remove_record(name)
+
+    def add_notice(self, notice: Notice, place: int = 0):
+        self.places['notes'].setdefault(notice.hashtag.hashtag, place)
+        super().add_notice(notice)
+
+    def remove_notice(self, key: str):
+        self.places['notes'].pop(key, None)
+        super().remove_notice(key)
+
+    def last_place(self) -> int:
+        return max((max(places.values(), default=0) for places in self.places.values()), default=0)
+
+    def placed(self, method: str, *args) -> list[tuple[int, Record]]:     # records found by method, with places
+        places = self.places['records']
+        return [(places[record.name.name], record) for record in getattr(self, method)(*args)]
+
+    def placed_keys(self, kind: str) -> list[tuple[int, str]]:
+        places = self.places[kind]
+        return [(places[key], key) for key in getattr(self, kind)]
+
+    def get_many(self, kind: str, keys: list[str]) -> list:     # None for missing keys
+        values = getattr(self, kind)
+        return [values.get(key) for key in keys]
+
+    def size_of(self, kind: str) -> int:
+        return len(getattr(self, kind))
+
+    def scored_fuzzy(self, query: str, count: int) -> list[tuple[float, Record]]:
+        return [(score, self.records[name]) for score, name in self._fuzzy_matches(query, count)]
+
+    def scored_notes(self, keyword: str) -> list[tuple[int, Note]]:
+        scores = self._note_index.scores(keyword)
+        return sorted(((score, note) for note, score in scores.items()), key=lambda pair: pair[0], reverse=True)
+
+
+shard_storage = None    # in a shard worker process: PickleStorage of the shard
+shard_book = None       # and the BookShard it holds
+
+
+def open_shard(index: int, compression: str | None) -> None:     # runs once in every worker process
+    global shard_storage, shard_book
+    shard_storage = PickleStorage(SHARD_FILE.format(index), Journal(SHARD_JOURNAL.format(index)), compression)
+    shard_book = shard_storage.load()
+    if shard_book is None:
+        shard_book = BookShard()
+    shard_book._catch_up()      # indexes of all shards are built at the same time
+
+
+def shard_call(method: str, *args):
+    return getattr(shard_book, method)(*args)
+
+
+def shard_change(kind: str, key: str, method: str, *args):     # the old value, a change is one round trip
+    old = getattr(shard_book, kind).get(key)
+    if old is None and method.startswith('remove_'):
+        return None
+    getattr(shard_book, method)(*args)
+    shard_storage.journal.log(method, *args)
+    return old
+
+
+def shard_save() -> None:
+    shard_storage.save(shard_book)
+
+
+class ShardedMapping(Mapping):     # records or notes of a ShardedAddressBook, asked from the shard holding them
+    def __init__(self, book: 'ShardedAddressBook', kind: str) -> None:
+        self.book = book
+        self.kind = kind
+
+    def __getitem__(self, key: str):
+        value = self.book._call(shard_of(key, len(self.book.workers)), 'get_many', self.kind, [key])[0]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def _placed_keys(self):     # (place, shard, key) of all shards, in the order of the whole book
+        return heapq.merge(*[[(place, shard, key) for place, key in keys]
+                             for shard, keys in enumerate(self.book._call_all('placed_keys', self.kind))])
+
+    def __iter__(self):
+        return (key for _, _, key in self._placed_keys())
+
+    def __len__(self) -> int:
+        return sum(self.book._call_all('size_of', self.kind))
+
+    def items(self):        # streamed in batches in the order of the whole book, each batch asked from all shards at once
+        placed = self._placed_keys()
+        while True:
+            batch = [(shard, key) for _, shard, key in islice(placed, LOAD_BATCH)]
+            if not batch:
+                return
+            keys = {}
+            for shard, key in batch:
+                keys.setdefault(shard, []).append(key)
+            futures = {shard: self.book.workers[shard].submit(shard_call, 'get_many', self.kind, shard_keys)
+                       for shard, shard_keys in keys.items()}
+            values = {}
+            for shard, future in futures.items():
+                values.update(zip(keys[shard], future.result()))
+            for _, key in batch:
+                if values[key] is not None:
+                    yield key, values[key]
+
+    def values(self):
+        return (value for _, value in self.items())
+
+
+class ShardedAddressBook(AddressBook):
+    # Same interface as AddressBook, but records and notes are split by the CRC32 of their key between worker
+    # processes, each keeping its shard in memory and in its own snapshot and journal. Searches run in all shards
+    # at once and the results are merged: contacts on the place in the whole book each shard keeps with them,
+    # ranked results by their scores.
+
+    def __init__(self, count: int, compression: str | None = None) -> None:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        context = get_context('spawn')      # the book may be opened by BackgroundLoader, forking a threaded process can hang
+        self.workers = [ProcessPoolExecutor(1, mp_context=context, initializer=open_shard, initargs=(index, compression))
+                        for index in range(count)]  # one process each, so a shard is always in the same one
+        self.records = ShardedMapping(self, 'records')
+        self.notes = ShardedMapping(self, 'notes')
+        self.dirty = set()      # shards changed since the last save
+        self._start_history()
+        self._sequence = max(self._call_all('last_place'))     # all shards are read at once
+
+    def _call(self, shard: int, method: str, *args):
+        return self.workers[shard].submit(shard_call, method, *args).result()
+
+    def _call_all(self, method: str, *args) -> list:
+        futures = [worker.submit(shard_call, method, *args) for worker in self.workers]
+        return [future.result() for future in futures]
+
+    def _change(self, kind: str, key: str, method: str, *args):
+        # waited for, so a change the shard could not make raises here before it is recorded for undo
+        shard = shard_of(key, len(self.workers))
+        self.dirty.add(shard)
+        return self.workers[shard].submit(shard_change, kind, key, method, *args).result()
+
+    def close(self) -> None:     # unsaved changes are lost
+        for worker in self.workers:
+            worker.shutdown(cancel_futures=True)
+
+    def add_record(self, record: Record):
+        name = record.name.name
+        self._sequence += 1
+        old = self._change('records', name, 'add_record', record, self._sequence)
+        self._changed('records', name, old, record)
+
+    def remove_record(self, name: str):
+        old = self._change('records', name, 'remove_record', name)
+        if old is not None:
+            self._changed('records', name, old, None)
+
+    def add_notice(self, notice: Notice):
+        key = notice.hashtag.hashtag
+        self._sequence += 1
+        old = self._change('notes', key, 'add_notice', notice, self._sequence)
+        self._changed('notes', key, old, notice)
+
+    def remove_notice(self, key: str):
+        old = self._change('notes', key, 'remove_notice', key)
+        if old is not None:
+            self._changed('notes', key, old, None)
+
+    def find_record(self, name: str) -> Record | None:
+        record = self.records.get(name)
+        if record is None:
+            record = next((record for record in self._call_all('find_record', name) if record is not None), None)
+        return record
+
+    def validate(self) -> list[tuple[str, str, str]]:
+        return [problem for problems in self._call_all('validate') for problem in problems]
+
+    def _merged(self, method: str, *args) -> list[Record]:      # in the order of the whole book
+        return [record for _, record in heapq.merge(*self._call_all('placed', method, *args), key=lambda pair: pair[0])]
+
+    def search_records(self, query: str) -> list[Record]:
+        return self._merged('search_records', query)
+
+    def _catch_up(self):
+        pass
+
+    def fuzzy_search(self, query: str, count: int = FUZZY_TOP) -> list[Record]:
+        matches = heapq.merge(*self._call_all('scored_fuzzy', query, count), key=lambda pair: -pair[0])
+        return [record for _, record in islice(matches, count)]
+
+    def who_calls(self, phone: str) -> list[Record]:
+        return self._merged('who_calls', phone)
+
+    def upcoming_birthdays(self, days: int, today: date | None = None) -> list[Record]:
+        if today is None:
+            today = date.today()
+        first = day_of_year(today)
+
+        def order(record):      # as AddressBook has them: from today to the end of the year, then from Jan 1
+            day = day_of_year(record.birthday.birthday)
+            return day < first, day, record.name.name
+        return list(heapq.merge(*self._call_all('upcoming_birthdays', days, today), key=order))
+
+    def note_searcher(self, keyword: str):
+        matches = heapq.merge(*self._call_all('scored_notes', keyword), key=lambda pair: -pair[0])
+        return [note for _, note in matches]
+
+    def hashtag_searcher(self, keyword: str):
+        return list(heapq.merge(*self._call_all('hashtag_searcher', keyword),
+                                key=lambda notice: (normalize_hashtag(notice.hashtag.hashtag), notice.hashtag.hashtag)))
+
+    def sort_notes(self):
+        return list(heapq.merge(*self._call_all('sort_notes'), key=lambda notice: notice.hashtag.hashtag))
+
+
+class ShardedStorage(Storage):     # every shard is read and written by its own process, only changed ones are saved
+    def __init__(self, count: int, journal: Journal, compression: str | None = None) -> None:
+        super().__init__(SHARD_MANIFEST, journal)
+        self.count = count
+        self.compression = compression
+        self.book = None
+
+    @staticmethod
+    def saved_count() -> int | None:    # shards of the book on disk
+        try:
+            with open(SHARD_MANIFEST, encoding='utf-8') as file:
+                return int(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def __str__(self) -> str:
+        return f'{self.count} shards ({SHARD_FILE.format("*")})'
+
+    def load(self) -> AddressBook | None:
+        if self.book is not None:
+            self.book.close()
+        self.book = ShardedAddressBook(self.count, self.compression)
+        self.journal.clear()
+        return self.book
+
+    def save(self, book: AddressBook) -> None:
+        if self.saved_count() != self.count:
+            write_atomically(SHARD_MANIFEST, str(self.count).encode())
+        futures = [book.workers[shard].submit(shard_save) for shard in sorted(book.dirty)]
+        for future in futures:
+            future.result()
+        book.dirty.clear()
+        self.journal.clear()
+
+
+journal = Journal(JOURNAL_FILE)
+storage = PickleStorage(BACKUP_FILE, journal)
+book_lock = RLock()     # held by commands and saves, so the autosave thread never sees a half-done change
+
+
 # General functionality
 
 
+class MissingArgument(Exception):
+    pass
+
+
+class Prompter:
+    def __init__(self, answers: dict[str, list[str]] | None = None) -> None:
+        self.answers = answers      # None - ask the user, otherwise name=value arguments of the command
+
+    def ask(self, key: str, prompt: str, default: str | None = None) -> str:
+        if self.answers is None:
+            console.flush()
+            return input(prompt)
+        values = self.answers.get(key)
+        if values:
+            return values.pop(0)
+        if default is None:
+            raise MissingArgument(key)
+        return default
+
+
+prompter = Prompter()
+console = ConsoleView()
+view = console          # where handlers send output other than their return value
+
+
+def ask(key: str, prompt: str, default: str | None = None) -> str:
+    return prompter.ask(key, prompt, default)
+
+
 def copy_class_addressbook(address_book):
-    return deepcopy(address_book)
+    return address_book.snapshot()
+
+
+class CommandMatcher:
+    def __init__(self, commands: dict) -> None:
+        self.order = {key: position for position, key in enumerate(commands)}
+        self.tree = BKTree()
+        self.keys_by_word = {}      # command or a word of it -> command keys
+        self.fragments = {}         # 3+ letter piece of a word -> words containing it
+        for key in commands:
+            for word in {key, *key.split()}:
+                if word not in self.keys_by_word:
+                    self.keys_by_word[word] = []
+                    self.tree.add(word)
+                    for start in range(len(word)):
+                        for end in range(start + 3, len(word) + 1):
+                            self.fragments.setdefault(word[start:end], set()).add(word)
+                self.keys_by_word[word].append(key)
+
+    def suggest(self, phrase: str) -> list[str]:
+        ranks = {}
+        for word in {phrase, *phrase.split()}:
+            if len(word) < 3:
+                continue
+            matches = [(0, match) for match in self.fragments.get(word, ())]
+            matches += self.tree.search(word, fuzzy_tolerance(word))
+            for distance, match in matches:
+                for key in self.keys_by_word[match]:
+                    ranks[key] = min(ranks.get(key, distance), distance)
+        # the closest to the whole phrase first, so "serch notes" puts "search notes" before "show notes"
+        return sorted(ranks, key=lambda key: (edit_distance(phrase, key), ranks[key], self.order[key]))
 
 
 def unknown_command(command: str) -> str:
     if len(command) < 4:
         return f'\nUnknown command "{command}"\n'
     else:
-        result = ''
-        subcomands = command.split(' ')
-        for key, value in commands.items():
-
-            for el in subcomands:
-                if len(el) > 2 and el in key:
-                    if key not in result:
-                        result += f'{key}{value[1]}\n'
-
-            if len(key) >= len(command):
-                start = 0
-                end = len(command) - 1
-                while True:
-                    if SequenceMatcher(a=command, b=key[start:end]).ratio() > 0.6 and key not in result:
-                        result += f'{key}{value[1]}\n'
-                    start += 1
-                    end += 1
-                    if end > len(key) - 1:
-                        break
+        global command_matcher
+        if command_matcher is None:
+            command_matcher = CommandMatcher(commands)
+        result = ''.join(f'{key}{commands[key][1]}\n' for key in command_matcher.suggest(command.lower()))
 
         if result:
             return f'\nUnknown command "{command}"\nPossibel commands:\n{result}'
@@ -283,29 +1865,269 @@ def hello_user() -> str:
 
 
 def exit_func() -> str:
-    a = input('Would you like to save changes (Y/N)? ')
+    if autosaver is not None:
+        autosaver.stop()        # the answer below decides about the changes made since the last autosave
+    a = ask('save', 'Would you like to save changes (Y/N)? ', 'N')
     if a == 'Y' or a == 'y':
-        print(saver())
+        view.display(saver())
     return 'Goodbye!\n'
 
 
+@timed('io: saver')
 def saver() -> str:
-    if address_book.records:
-        with open('backup.dat', 'wb') as file:
-            pickle.dump(address_book, file)
-        return '\nAddress Book successfully saved to backup.dat'
-    else:
-        return '\nAddress Book is empty, no data to be saved to file'
+    with book_lock:
+        if address_book.records or journal.unsaved:
+            storage.save(address_book)
+            return f'\nAddress Book successfully saved to {storage}'
+        else:
+            return '\nAddress Book is empty, no data to be saved to file'
 
 
+@timed('io: loader')
 def loader() -> str:
-    try:
-        with open('backup.dat', 'rb') as file:
-            global address_book
-            address_book = pickle.load(file)
-        return '\nAddress Book successfully loaded from backup.dat\n'
-    except:
+    global address_book
+    existed = storage.exists()      # SQLite and shards start a new book where none was saved
+    book = storage.load()
+    if book is None:
+        return ''
+    address_book = book
+    if reminders is not None:
+        reminders.watch(book)
+    if not existed:
         return ''
+    return f'\nAddress Book successfully loaded from {storage}\n'
+
+
+class BackgroundLoader(Thread):    # reads the saved book while the user types the first command
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.message = ''
+
+    def run(self) -> None:
+        self.message = loader()
+
+
+AUTOSAVE_INTERVAL = 30      # seconds
+AUTOSAVE_CHANGES = 100      # pending changes that trigger a save before the interval is over
+
+
+class Autosaver(Thread):     # saves pending changes in the background, all of them at once
+    def __init__(self, interval: float, changes: int = AUTOSAVE_CHANGES) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.changes = changes
+        self.wakeup = Event()
+        self.running = True
+
+    def changed(self) -> None:      # called after every command
+        if journal.unsaved >= self.changes:
+            self.wakeup.set()
+
+    def stop(self) -> None:
+        self.running = False
+        self.wakeup.set()
+
+    def run(self) -> None:
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            with book_lock:
+                if self.running and journal.unsaved:
+                    try:
+                        saver()
+                    except OSError as error:
+                        console.display(f'\nAutosave failed: {error}\n')
+                        console.flush()
+
+
+autosaver = None
+
+
+REMINDER_RECHECK = 3600     # longest sleep in seconds, so a changed system clock is noticed
+
+
+class BirthdayReminders(Thread):   # sleeps until the next birthday and tells about it, O(log n) per birthday
+    def __init__(self, ahead: int = 0, output: DisplayView | None = None) -> None:
+        super().__init__(daemon=True)
+        self.ahead = timedelta(days=ahead)      # how long before the birthday to remind
+        self.output = output or console
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.book = None
+        self.birthdays = {}     # record name -> birthday
+        self.due = {}           # record name -> day of its reminder, heap entries with another day are stale
+        self.heap = []          # (day of the reminder, record name)
+        self.reminded = {}      # record name -> day of the last reminder, so a reload does not repeat it
+
+    def _schedule(self, name: str, birthday: date, today: date) -> None:
+        day = next_birthday(birthday, today + self.ahead) - self.ahead
+        self.due[name] = day
+        heapq.heappush(self.heap, (day, name))
+        if self.heap[0] == (day, name):
+            self.wakeup.set()
+
+    def watch(self, book: AddressBook) -> None:    # all birthdays of a newly loaded book
+        today = date.today()
+        with self.lock:
+            if self.book is not None:
+                self.book._watchers.remove(self.changed)
+            self.book = book
+            book._watchers.append(self.changed)
+            self.birthdays = {record.name.name: record.birthday.birthday for record in book.upcoming_birthdays(366)}
+            self.due = {name: next_birthday(birthday, today + self.ahead) - self.ahead
+                        for name, birthday in self.birthdays.items()}
+            self.heap = [(day, name) for name, day in self.due.items()]
+            heapq.heapify(self.heap)
+        self.wakeup.set()
+
+    def changed(self, kind: str, key: str, new) -> None:
+        if kind != 'records':
+            return
+        birthday = new.birthday.birthday if new is not None and new.birthday is not None else None
+        with self.lock:
+            if self.birthdays.get(key) == birthday:
+                return
+            self.due.pop(key, None)
+            if birthday is None:
+                self.birthdays.pop(key, None)
+            else:
+                self.birthdays[key] = birthday
+                self._schedule(key, birthday, date.today())
+            if len(self.heap) > 2 * len(self.due) + 100:     # mostly stale entries
+                self.heap = [(day, name) for name, day in self.due.items()]
+                heapq.heapify(self.heap)
+
+    def remind(self, name: str, day: date) -> None:
+        birthday = self.birthdays[name]
+        occurrence = day + self.ahead
+        when = 'Today' if not self.ahead else f'On {occurrence:%A, %d %B}'
+        self.output.display(f'\n{when} is the birthday of {name}, turning {occurrence.year - birthday.year}\n')
+        self.output.flush()
+
+    def run(self) -> None:
+        while True:
+            with self.lock:
+                today = date.today()
+                while self.heap and self.heap[0][0] <= today:
+                    day, name = heapq.heappop(self.heap)
+                    if self.due.get(name) != day:
+                        continue
+                    if self.reminded.get(name) != day:
+                        self.reminded[name] = day
+                        self.remind(name, day)
+                    self._schedule(name, self.birthdays[name], day + timedelta(days=1))
+                timeout = REMINDER_RECHECK
+                if self.heap:
+                    start = datetime.combine(self.heap[0][0], datetime.min.time())
+                    timeout = min(timeout, max((start - datetime.now()).total_seconds(), 0))
+                self.wakeup.clear()
+            self.wakeup.wait(timeout)
+
+
+reminders = None
+
+
+def migrator() -> str:
+    if not isinstance(address_book, SQLiteAddressBook):
+        return f'\nStart the bot with "--storage sqlite" to move {BACKUP_FILE} into {DATABASE_FILE}\n'
+    source = PickleStorage(BACKUP_FILE, Journal(JOURNAL_FILE)).load()
+    if source is None:
+        return f'\nNothing to migrate, {BACKUP_FILE} not found\n'
+    contacts = notes = skipped = 0
+    for name, record in source.records.items():
+        if name in address_book.records:
+            skipped += 1
+        else:
+            address_book.add_record(record)
+            contacts += 1
+    for hashtag, notice in source.notes.items():
+        if hashtag in address_book.notes:
+            skipped += 1
+        else:
+            address_book.add_notice(notice)
+            notes += 1
+    storage.save(address_book)
+    return (f'\nMoved {contacts} contacts and {notes} notes from {BACKUP_FILE} to {storage.path}'
+            f'{f", skipped {skipped} already present" if skipped else ""}\n')
+
+
+PAGE_CHUNK = 100        # records rendered at once when everything is shown without pauses
+page_cursors = {}       # where the last interrupted listing stopped, by listing name
+
+
+def show_pages(essence: dict, cursor: str, N: int) -> bool:
+    start = page_cursors.pop(cursor, 0)
+    if start and start < len(essence):
+        if ask('resume', f'Continue from position {start + 1} (Y/N)? ', 'N') not in ('Y', 'y'):
+            start = 0
+    else:
+        start = 0
+
+    show_all = start + N >= len(essence)
+    if show_all:
+        view.display('\nPrintting all records:\n' if start == 0 else f'\nPrintting records from {start + 1}:\n')
+    for offset, page in address_book.iterator(PAGE_CHUNK if show_all else N, essence, start):
+        view.display(page)
+        if not show_all and offset < len(essence):
+            if ask('more', 'Press Enter to continue or "q" to stop: ', '') in ('Q', 'q'):
+                page_cursors[cursor] = offset
+                return False
+            view.display(f'\nPrinting next {N} records\n')
+    return True
+
+
+def stats_handler() -> str:
+    action = ask('action', 'Enter "on", "off", "export" or press Enter to show statistics: ', '').strip().lower()
+    if action == 'on':
+        enable_instrumentation()
+        return '\nCommand statistics are collected from now on\n'
+    elif action == 'off':
+        disable_instrumentation()
+        return '\nCommand statistics are no longer collected\n'
+    elif action == 'export':
+        path = ask('path', 'Enter file name (ex. stats.json): ', 'stats.json').strip()
+        stats.export(path)
+        return f'\nStatistics exported to {path}\n'
+    elif action:
+        return 'Invalid action'
+
+    summary = stats.summary()
+    if not summary:
+        return '\nNo statistics yet' + ('' if stats.enabled else ', enable them with "stats" -> "on"') + '\n'
+    result = '{:<16} {:>7} {:>10} {:>10} {:>10} {:>10}\n'.format('command', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')
+    for name, row in summary.items():
+        result += '{:<16} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}\n'.format(
+            name, row['calls'], row['p50'] * 1000, row['p95'] * 1000, row['p99'] * 1000, row['max'] * 1000)
+    return '\n' + result
+
+
+def log_changes(changes: list) -> None:
+    for kind, key, old, new in changes:
+        kind = 'record' if kind == 'records' else 'notice'
+        if new is None:
+            journal.log(f'remove_{kind}', key)
+        else:
+            journal.log(f'add_{kind}', new)
+
+
+def describe_changes(changes: list) -> str:
+    return ', '.join(dict.fromkeys(key for _, key, _, _ in changes))
+
+
+def undo_handler() -> str:
+    changes = address_book.undo()
+    if changes is None:
+        return 'Nothing to undo'
+    log_changes(changes)
+    return f'\nUndone the last change of: {describe_changes(changes)}\n'
+
+
+def redo_handler() -> str:
+    changes = address_book.redo()
+    if changes is None:
+        return 'Nothing to redo'
+    log_changes(changes)
+    return f'\nRedone the change of: {describe_changes(changes)}\n'
 
 
 def helper():
@@ -318,55 +2140,60 @@ def helper():
 # Contacts processing
 
 
+def commit_record(record: Record, old_name: str | None = None) -> None:
+    address_book.update_record(record, old_name)
+    journal.log('update_record', record, old_name)
+
+
 def phone_adder(record) -> None:
     while True:
-        phone = input(
-            'Enter phone (ex. +38(099)1234567) or press Enter to skip: ')
+        phone = ask('phone',
+            'Enter phone (ex. +38(099)1234567) or press Enter to skip: ', '')
         if phone == '':
             break
         elif Phone.phone_validator(phone) == True:
             record.add_phone(Phone(phone))
             break
         else:
-            print('Wrong phone format')
+            view.display('Wrong phone format')
 
 
 def email_adder(record) -> None:
     while True:
-        email = input('Enter email or press Enter to skip: ')
+        email = ask('email', 'Enter email or press Enter to skip: ', '')
         if email == '':
             break
         elif Email.email_validator(email) == True:
             record.add_email(Email(email))
             break
         else:
-            print('Wrong email format')
+            view.display('Wrong email format')
 
 
 def birthday_adder(record) -> None:
     while True:
-        birthday = input(
-            'Enter birthday (ex. 2023.12.25) or press Enter to skip: ')
+        birthday = ask('birthday',
+            'Enter birthday (ex. 2023.12.25) or press Enter to skip: ', '')
         if birthday == '':
             break
         elif Birthday.date_validator(birthday) == True:
             record.add_birthday(Birthday(birthday))
             break
         else:
-            print('Wrong date format')
+            view.display('Wrong date format')
 
 
 def contact_adder() -> str:
-    name = input('Enter contact name (obligatory field): ')
+    name = ask('name', 'Enter contact name (obligatory field): ')
     while True:
         if name == '':
-            name = input(
-                'Contact name cannot be empty, enter contact name o Enter to exit: ')
+            name = ask('name',
+                'Contact name cannot be empty, enter contact name o Enter to exit: ', '')
             if name == '':
                 return 'Adding new contact was skipped\n'
         elif name in address_book.records.keys():
-            name = input(
-                f'Contact "{name}" already exists, enter new name o press Enter to exit: ')
+            name = ask('name',
+                f'Contact "{name}" already exists, enter new name o press Enter to exit: ', '')
             if name == '':
                 return 'Adding new contact was skipped\n'
         else:
@@ -374,207 +2201,223 @@ def contact_adder() -> str:
 
     record = Record(Name(name))
 
-    address = input('Enter address or press Enter to skip: ')
+    address = ask('address', 'Enter address or press Enter to skip: ', '')
     if address:
         record.add_address(Address(address))
 
     while True:
-        phone = input(
-            'Enter phone (ex. +38(099)1234567) or press Enter to skip: ')
+        phone = ask('phone',
+            'Enter phone (ex. +38(099)1234567) or press Enter to skip: ', '')
         if phone == '':
             break
         elif Phone.phone_validator(phone) == True:
             record.add_phone(Phone(phone))
         else:
-            print('Wrong phone format')
+            view.display('Wrong phone format')
 
     email_adder(record)
     birthday_adder(record)
 
     address_book.add_record(record)
+    journal.log('add_record', record)
 
     return f'\nAdded contact\n{record}'
 
 
 def show_all_contacts() -> str:
     if address_book.records:
-        N = int(input('How many contacts to show? '))
+        N = int(ask('count', 'How many contacts to show? '))
         if N < 1:
             return 'Input cannot be less that 1'
-        elif N >= len(address_book.records):
-            result = '\nPrintting all records:\n'
-            for key, value in address_book.records.items():
-                result += f'\n{value}'
-            result += '\nEnd of address book\n'
-            return result
-        else:
-            iter = address_book.iterator(N, address_book.records)
-            for i in iter:
-                print(i)
-                input('Press any key to continue: ')
-            if len(address_book.records) % 2 == 0:
-                return '\nEnd of address book\n'
-            else:
-                return f'{str(list(address_book.records.values())[-1])}\nEnd of address book\n'
+        elif show_pages(address_book.records, 'contacts', N):
+            return '\nEnd of address book\n'
+        else:
+            return '\nListing stopped, "show contacts" can continue from here\n'
     else:
         return 'No contacts, please add\n'
 
 
 def contact_search() -> str:
-    search_query = input('Enter search query: ')
+    search_query = ask('query', 'Enter search query: ')
     search_query = search_query.lower()
 
-    search_results = []
-    for record in address_book.records.values():
-        if (record.name.name and search_query in record.name.name.lower()) or \
-           (record.address and search_query in record.address.lower()) or \
-           (record.email and search_query in record.email.lower()) or \
-           (record.birthday and search_query in str(record.birthday)) or \
-                any(search_query in phone.phone for phone in record.phones):
-            search_results.append(record)
+    search_results = address_book.search_records(search_query)
 
     if search_results:
         contacts_info = '\n'.join(str(record) for record in search_results)
         return f'\nContacts found:\n{contacts_info}'
 
+    similar = address_book.fuzzy_search(search_query)
+    if similar:
+        contacts_info = '\n'.join(str(record) for record in similar)
+        return f'\nNo contacts found for "{search_query}", the closest ones:\n{contacts_info}'
     return f'No contacts found for "{search_query}"'
 
 
+def fuzzy_search_handler() -> str:
+    query = ask('query', 'Enter name, email or address, typos allowed: ')
+    count = int(ask('count', f'How many contacts to show (Enter for {FUZZY_TOP})? ', '') or FUZZY_TOP)
+    result = address_book.fuzzy_search(query, count)
+    if result:
+        return '\nClosest contacts:\n' + '\n'.join(str(record) for record in result)
+    return f'No contacts similar to "{query}"'
+
+
+def caller_finder() -> str:
+    phone = ask('phone', 'Enter the phone number in any format (ex. 099 123 45 67): ')
+    result = address_book.who_calls(phone)
+    if result:
+        return f'\n{phone} is the number of:\n' + '\n'.join(str(record) for record in result)
+    return f'No contacts with the number "{phone}"'
+
+
+def book_validator() -> str:
+    problems = address_book.validate()
+    if not problems:
+        return '\nAll contacts pass validation\n'
+    result = '\n'.join(f'{name}: wrong {field} "{value}"' for name, field, value in problems)
+    return f'\nFound {len(problems)} problems:\n{result}\n'
+
+
 def contact_modifier():
-    name = input('Enter contact name: ')
-    for record_name, contact in address_book.records.items():
-        if contact.name.name.lower() == name.lower():
-            print(f'Current contact information:\n{contact}')
-            field = input(
-                'Enter the field you want to modify (name/address/phone/email/birthday): ')
-
-            if field.lower() == 'name':
-                value = input('Enter the new value: ')
-                contact.name.name = value
-                address_book.records[value] = contact
-                del address_book.records[record_name]
-                return f'Contact "{name}" has been modified. New name: "{value}"'
-            elif field.lower() == 'address':
-                value = input('Enter the new value: ')
-                contact.address = Address(value)
-                return f'Contact "{name}" has been modified. New address: "{value}"'
-            elif field.lower() == 'phone':
-                phone_count = len(contact.phones)
-                if phone_count == 0:
-                    action = input('Enter "add" to add a new phone number: ')
-                    if action.lower() == 'add':
-                        phone = input(
-                            'Enter the new phone number (ex. +38(099)1234567): ')
-                        if Phone.phone_validator(phone):
-                            contact.phones.append(Phone(phone))
-                            return f'Contact "{name}" has been modified. New phone number added: {phone}'
-                        else:
-                            return 'Wrong phone format'
-                    else:
-                        return 'Invalid action. Modification failed.'
+    name = ask('name', 'Enter contact name: ')
+    contact = address_book.find_record(name)
+    if contact is None:
+        return f'Contact "{name}" not found'
+    record_name = contact.name.name
+    contact = contact.copy()
+
+    view.display(f'Current contact information:\n{contact}')
+    field = ask('field',
+        'Enter the field you want to modify (name/address/phone/email/birthday): ')
+
+    if field.lower() == 'name':
+        value = ask('value', 'Enter the new value: ')
+        contact.name = Name(value)
+        commit_record(contact, record_name)
+        return f'Contact "{name}" has been modified. New name: "{value}"'
+    elif field.lower() == 'address':
+        value = ask('value', 'Enter the new value: ')
+        contact.address = Address(value)
+        commit_record(contact)
+        return f'Contact "{name}" has been modified. New address: "{value}"'
+    elif field.lower() == 'phone':
+        phone_count = len(contact.phones)
+        if phone_count == 0:
+            action = ask('action', 'Enter "add" to add a new phone number: ')
+            if action.lower() == 'add':
+                phone = ask('phone',
+                    'Enter the new phone number (ex. +38(099)1234567): ')
+                if Phone.phone_validator(phone):
+                    contact.phones.append(Phone(phone))
+                    commit_record(contact)
+                    return f'Contact "{name}" has been modified. New phone number added: {phone}'
                 else:
-                    print('Current phone numbers:')
-                    for i, phone in enumerate(contact.phones):
-                        print(f'{i + 1}. {phone}')
-                    selection = int(input(
-                        f'Select the phone number you want to modify or enter "{phone_count + 1}" to add a new phone number: '))
-                    if 1 <= selection <= phone_count:
-                        action = input(
-                            'Enter "replace" to replace the phone number: ')
-                        if action.lower() == 'replace':
-                            phone = input(
-                                'Enter the new phone number (ex. +38(099)1234567): ')
-                            if Phone.phone_validator(phone):
-                                contact.phones[selection - 1] = Phone(phone)
-                                return f'Contact "{name}" has been modified. New phone number: {phone}'
-                            else:
-                                return 'Wrong phone format'
-                        else:
-                            return 'Invalid action. Modification failed.'
-                    elif selection == phone_count + 1:
-                        phone = input(
-                            'Enter the new phone number (ex. +38(099)1234567): ')
-                        if Phone.phone_validator(phone):
-                            contact.phones.append(Phone(phone))
-                            return f'Contact "{name}" has been modified. New phone number added: {phone}'
-                        else:
-                            return 'Wrong phone format'
+                    return 'Wrong phone format'
+            else:
+                return 'Invalid action. Modification failed.'
+        else:
+            view.display('Current phone numbers:')
+            for i, phone in enumerate(contact.phones):
+                view.display(f'{i + 1}. {phone}')
+            selection = int(ask('selection',
+                f'Select the phone number you want to modify or enter "{phone_count + 1}" to add a new phone number: '))
+            if 1 <= selection <= phone_count:
+                action = ask('action',
+                    'Enter "replace" to replace the phone number: ')
+                if action.lower() == 'replace':
+                    phone = ask('phone',
+                        'Enter the new phone number (ex. +38(099)1234567): ')
+                    if Phone.phone_validator(phone):
+                        contact.phones[selection - 1] = Phone(phone)
+                        commit_record(contact)
+                        return f'Contact "{name}" has been modified. New phone number: {phone}'
                     else:
-                        return 'Invalid selection. Modification failed.'
-
-            elif field.lower() == 'email':
-                value = input('Enter the new value: ')
-                if Email.email_validator(value) == True:
-                    contact.email = Email(value)
-                    return f'Contact "{name}" has been modified. New email: "{value}"'
+                        return 'Wrong phone format'
                 else:
-                    return 'Wrong email format'
-            elif field.lower() == 'birthday':
-                value = input('Enter the new value (ex. 2023.12.25): ')
-                if Birthday.date_validator(value) == True:
-                    contact.birthday = Birthday(value)
-                    return f'Contact "{name}" has been modified. New birthday: "{value}"'
+                    return 'Invalid action. Modification failed.'
+            elif selection == phone_count + 1:
+                phone = ask('phone',
+                    'Enter the new phone number (ex. +38(099)1234567): ')
+                if Phone.phone_validator(phone):
+                    contact.phones.append(Phone(phone))
+                    commit_record(contact)
+                    return f'Contact "{name}" has been modified. New phone number added: {phone}'
                 else:
-                    return 'Wrong date format'
+                    return 'Wrong phone format'
             else:
-                return 'Invalid field name. Modification failed.'
-    return f'Contact "{name}" not found'
+                return 'Invalid selection. Modification failed.'
+
+    elif field.lower() == 'email':
+        value = ask('value', 'Enter the new value: ')
+        if Email.email_validator(value) == True:
+            contact.email = Email(value)
+            commit_record(contact)
+            return f'Contact "{name}" has been modified. New email: "{value}"'
+        else:
+            return 'Wrong email format'
+    elif field.lower() == 'birthday':
+        value = ask('value', 'Enter the new value (ex. 2023.12.25): ')
+        if Birthday.date_validator(value) == True:
+            contact.birthday = Birthday(value)
+            commit_record(contact)
+            return f'Contact "{name}" has been modified. New birthday: "{value}"'
+        else:
+            return 'Wrong date format'
+    else:
+        return 'Invalid field name. Modification failed.'
 
 
 def contact_remover() -> str:
-    name = input('Enter contact name: ')
-    for record_name, record in address_book.records.items():
-        if record.name.name == name:
-            print(f'Contact found: {record.name.name}')
-            choice = input(
-                'Enter the field to remove (1- contact, 2 - number, 3 - email, 4 - adress, 5 - birthday) ')
-            if choice == '1':
-                del address_book.records[record_name]
-                return f'Contact "{name} has been removed'
-            elif choice == '2':
-                print('Phone numbers:')
-                for i, phone in enumerate(record.phones):
-                    print(f'{i+1}. {phone}')
-                phone_choice = int(input(
-                    'Enter the number of the phone to remove, or enter 0 to remove all phone numbers: '))
-                if phone_choice == 0:
-                    record.phones = []
-                    return f'All phone numbers removed from contact {name}'
-                elif 1 <= phone_choice <= len(record.phones):
-                    del record.phones[phone_choice - 1]
-                    return f'Phone number {phone_choice} removed from contact {name}'
-                else:
-                    return 'Invalid phone number choice'
-            elif choice == '3':
-                record.email = None
-                return f'Email removed from contact {name}'
-            elif choice == '4':
-                record.address = None
-                return f'Address removed from contact {name}'
-            elif choice == '5':
-                record.birthday = None
-                return f'Birthday removed from contact {name}'
-            else:
-                return f'Invalid choice'
+    name = ask('name', 'Enter contact name: ')
+    record = address_book.records.get(name)
+    if record is None:
         return f'Contact "{name}" not found'
+    record_name = name
+    record = record.copy()
+
+    view.display(f'Contact found: {record.name.name}')
+    choice = ask('field',
+        'Enter the field to remove (1- contact, 2 - number, 3 - email, 4 - adress, 5 - birthday) ')
+    if choice == '1':
+        address_book.remove_record(record_name)
+        journal.log('remove_record', record_name)
+        return f'Contact "{name} has been removed'
+    elif choice == '2':
+        view.display('Phone numbers:')
+        for i, phone in enumerate(record.phones):
+            view.display(f'{i+1}. {phone}')
+        phone_choice = int(ask('number',
+            'Enter the number of the phone to remove, or enter 0 to remove all phone numbers: '))
+        if phone_choice == 0:
+            record.phones = []
+            commit_record(record)
+            return f'All phone numbers removed from contact {name}'
+        elif 1 <= phone_choice <= len(record.phones):
+            del record.phones[phone_choice - 1]
+            commit_record(record)
+            return f'Phone number {phone_choice} removed from contact {name}'
+        else:
+            return 'Invalid phone number choice'
+    elif choice == '3':
+        record.email = None
+        commit_record(record)
+        return f'Email removed from contact {name}'
+    elif choice == '4':
+        record.address = None
+        commit_record(record)
+        return f'Address removed from contact {name}'
+    elif choice == '5':
+        record.birthday = None
+        commit_record(record)
+        return f'Birthday removed from contact {name}'
+    else:
+        return f'Invalid choice'
 
 
 def days_to_birthdays() -> str:
-    days = int(input('Enter the number of days: '))
-    today = datetime.today().date()
-    result = ''
-
-    for record in address_book.records.values():
-        if record.birthday is not None:
-            dob = record.birthday.birthday
-            dob_this_year = dob.replace(year=today.year)
-
-            if dob_this_year < today:
-                dob_this_year = dob_this_year.replace(year=today.year + 1)
-
-            days_to_birthday = (dob_this_year - today).days
-            if days_to_birthday <= days:
-                result += f'\n{record}'
+    days = int(ask('days', 'Enter the number of days: '))
+    result = ''.join(f'\n{record}' for record in address_book.upcoming_birthdays(days))
     if result == '':
         return "\nNo contacts with upcoming birthdays\n"
     else:
@@ -585,7 +2428,7 @@ def days_to_birthdays() -> str:
 
 
 def note_adder():
-    hashtag = input('Enter hashtag for your note (ex. #todo): ')
+    hashtag = ask('hashtag', 'Enter hashtag for your note (ex. #todo): ', '')
     if hashtag in address_book.notes.keys():
         return f'Note with hashtag {hashtag} already exists'
 
@@ -594,41 +2437,31 @@ def note_adder():
 
     notice = Notice(Hashtag(hashtag))
 
-    note = input('Enter note: ')
+    note = ask('note', 'Enter note: ', '')
     if note:
         notice.add_note(Note(note))
 
     address_book.add_notice(notice)
+    journal.log('add_notice', notice)
 
     return f'\nAdded reccord with {notice}'
 
 
 def show_all_notes() -> str:
     if address_book.notes:
-        N = int(input('How many records to show? '))
+        N = int(ask('count', 'How many records to show? '))
         if N < 1:
             return 'Input cannot be less that 1'
-        elif N >= len(address_book.notes):
-            result = '\nPrintting all records:\n'
-            for key, value in address_book.notes.items():
-                result += f'\n{value}'
-            result += '\nEnd of records\n'
-            return result
-        else:
-            iter = address_book.iterator(N, address_book.notes)
-            for i in iter:
-                print(i)
-                input('Press any key to continue: ')
-            if len(address_book.notes) % 2 == 0:
-                return '\nEnd of records\n'
-            else:
-                return f'{str(list(address_book.notes.values())[-1])}\nEnd of records\n'
+        elif show_pages(address_book.notes, 'notes', N):
+            return '\nEnd of records\n'
+        else:
+            return '\nListing stopped, "show notes" can continue from here\n'
     else:
         return 'No records, please add\n'
 
 
 def note_search_handler():
-    keyword = input('Enter a keyword to search: ')
+    keyword = ask('keyword', 'Enter a keyword to search: ')
     if keyword:
         result = address_book.note_searcher(keyword)
         if result:
@@ -640,7 +2473,7 @@ def note_search_handler():
 
 
 def hashtag_search_handler():
-    keyword = input('Enter a hashtag to search: ')
+    keyword = ask('hashtag', 'Enter a hashtag to search: ')
     if keyword:
         result = address_book.hashtag_searcher(keyword)
         if result:
@@ -659,52 +2492,377 @@ def sort_notes_handler():
         return 'No notes found.'
 
 
+# Import and export
+
+
+IMPORT_BATCH = 10000
+MAX_REPORTED_ERRORS = 20
+CONTACT_COLUMNS = ('name', 'address', 'phones', 'email', 'birthday')
+NOTE_COLUMNS = ('hashtag', 'note')
+
+
+def read_rows(path: str):
+    import csv
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield line      # parsed by import_rows(), so a broken line is a row error
+
+
+TEXT_COLUMNS = ('name', 'address', 'email', 'birthday')
+
+
+def row_type_error(row: dict) -> str | None:     # JSON rows may hold numbers, lists or objects where text belongs
+    for column in TEXT_COLUMNS:
+        if not isinstance(row.get(column, ''), (str, type(None))):
+            return f'"{column}" should be a text'
+    phones = row.get('phones')
+    if phones is None or isinstance(phones, str):
+        return None
+    if not isinstance(phones, list) or not all(isinstance(phone, str) for phone in phones):
+        return '"phones" should be a list of texts or a ";"-separated text'
+    return None
+
+
+def records_from_rows(rows: list[dict]) -> list[Record | str]:    # a Record, or why the row was rejected
+    type_errors = [row_type_error(row) for row in rows]
+    rows = [{} if error else row for row, error in zip(rows, type_errors)]      # nothing in them is validated
+    phone_lists = []
+    for row in rows:
+        phones = row.get('phones') or []
+        if isinstance(phones, str):
+            phones = phones.split(';')
+        phone_lists.append([phone.strip() for phone in phones])
+    emails = [row.get('email') or '' for row in rows]
+
+    phones_valid = iter(validate_phones([phone for phones in phone_lists for phone in phones]))
+    emails_valid = validate_emails(emails)
+    birthdays = parse_birthdays([row.get('birthday') or '' for row in rows])
+
+    result = []
+    for row, type_error, phones, email, email_valid, birthday in zip(rows, type_errors, phone_lists, emails,
+                                                                     emails_valid, birthdays):
+        checks = [next(phones_valid) for _ in phones]
+        name = (row.get('name') or '').strip()
+        if type_error:
+            result.append(type_error)
+        elif not name:
+            result.append('empty name')
+        elif not all(checks):
+            result.append(f'wrong phone format "{phones[checks.index(False)]}"')
+        elif email and not email_valid:
+            result.append(f'wrong email format "{email}"')
+        elif row.get('birthday') and birthday is None:
+            result.append(f'wrong date format "{row["birthday"]}"')
+        else:
+            address = row.get('address')
+            result.append(Record(Name(name),
+                                 Address(address) if address else None,
+                                 [Phone(phone) for phone in phones],
+                                 Email(email) if email else None,
+                                 Birthday(birthday) if birthday else None))
+    return result
+
+
+def import_notes_row(row: dict) -> None:
+    hashtag = row.get('hashtag') or '#None'
+    if not isinstance(hashtag, str):
+        raise ValueError('"hashtag" should be a text')
+    hashtag = hashtag.strip()
+    notes = row.get('notes', row.get('note')) or []
+    if isinstance(notes, str):
+        notes = [notes]
+    if not isinstance(notes, list) or not all(isinstance(note, str) for note in notes):
+        raise ValueError('"note" should be a text or a list of texts')
+    notes = [note for note in notes if note]
+
+    notice = address_book.notes.get(hashtag)
+    notice = Notice(Hashtag(hashtag)) if notice is None else notice.copy()
+    for note in notes:
+        notice.add_note(Note(note))
+    address_book.add_notice(notice)
+    journal.log('add_notice', notice)
+
+
+def import_rows(rows) -> tuple[int, int]:
+    imported = errors = 0
+    row_number = 0
+    while True:
+        batch = list(islice(rows, IMPORT_BATCH))
+        if not batch:
+            address_book._catch_up()    # indexed here, so the import and not the next search takes the time
+            return imported, errors
+
+        problems = []
+        contacts = []
+        for row in batch:
+            row_number += 1
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError('a row should be an object of column: value')
+                if 'hashtag' in row:
+                    import_notes_row(row)
+                    imported += 1
+                else:
+                    contacts.append((row_number, row))
+            except (ValueError, TypeError, AttributeError) as error:
+                problems.append((row_number, str(error)))
+
+        records = records_from_rows([row for _, row in contacts])
+        for (number, _), record in zip(contacts, records):
+            if isinstance(record, str):
+                problems.append((number, record))
+            elif record.name.name in address_book.records:
+                problems.append((number, f'contact "{record.name.name}" already exists'))
+            else:
+                address_book.add_record(record)
+                journal.log('add_record', record)
+                imported += 1
+
+        for number, problem in sorted(problems):
+            errors += 1
+            if errors <= MAX_REPORTED_ERRORS:
+                view.display(f'Row {number}: {problem}')
+
+
+def importer() -> str:
+    import csv
+    path = ask('path', 'Enter path to a .csv or .jsonl file: ').strip()
+    if not os.path.isfile(path):
+        return 'File not found.'
+    try:
+        with collection_paused():
+            imported, errors = import_rows(read_rows(path))
+    except csv.Error as error:
+        return f'Import stopped, file is damaged: {error}'
+    if errors > MAX_REPORTED_ERRORS:
+        view.display(f'... and {errors - MAX_REPORTED_ERRORS} more errors')
+    return f'\nImported {imported} rows, skipped {errors} rows with errors\n'
+
+
+def contact_to_row(record: Record) -> dict:
+    return {
+        'name': record.name.name,
+        'address': str(record.address) if record.address is not None else '',
+        'phones': [phone.phone for phone in record.phones],
+        'email': str(record.email) if record.email is not None else '',
+        'birthday': record.birthday.birthday.strftime('%Y.%m.%d') if record.birthday is not None else '',
+    }
+
+
+def exporter() -> str:
+    kind = ask('kind', 'What to export (contacts/notes)? ').strip().lower()
+    if kind not in ('contacts', 'notes'):
+        return 'Unknown data type, enter "contacts" or "notes".'
+    path = ask('path', 'Enter path to a .csv or .jsonl file: ').strip()
+
+    if kind == 'contacts':
+        rows = (contact_to_row(record) for record in address_book.records.values())
+        columns = CONTACT_COLUMNS
+    else:
+        rows = ({'hashtag': key, 'notes': [note.note for note in notice.notes]}
+                for key, notice in address_book.notes.items())
+        columns = NOTE_COLUMNS
+
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if path.lower().endswith('.csv'):
+            import csv
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            for row in rows:
+                if kind == 'contacts':
+                    writer.writerow([row['name'], row['address'], ';'.join(row['phones']),
+                                     row['email'], row['birthday']])
+                else:
+                    writer.writerows([row['hashtag'], note] for note in row['notes'] or [''])
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + '\n')
+                count += 1
+    return f'\nExported {count} {kind} to {path}\n'
+
+
 # File sorting
 
 
-def sort_files():
-    folder_path = input(
-        "Enter the absolute path of the folder you want to sort (example: C:\Desktop\project): ")
-    folder_path = folder_path.strip()
+FILE_CATEGORIES = {
+    '.jpg': 'Images', '.png': 'Images', '.gif': 'Images',
+    '.doc': 'Documents', '.docx': 'Documents', '.pdf': 'Documents',
+    '.mp4': 'Videos', '.avi': 'Videos', '.mov': 'Videos',
+}
+DEFAULT_CATEGORY = 'Other'
+DUPLICATES_FOLDER = 'Duplicates'
+CATEGORIES_FILE = 'sort_categories.json'    # optional {"Category": [".ext", ...]} overriding FILE_CATEGORIES
+SKIPPED_FILES = {'butler.py', CATEGORIES_FILE, BACKUP_FILE, JOURNAL_FILE, SHARD_MANIFEST,    # the bot's own files, also as .tmp
+                 DATABASE_FILE, *(DATABASE_FILE + suffix for suffix in ('-journal', '-wal', '-shm'))}
+SKIPPED_SHARD_FILES = re.compile('|'.join(re.escape(name).replace(re.escape('{}'), r'\d+') for name in (SHARD_FILE, SHARD_JOURNAL)))
+SORT_WORKERS = 8
 
-    if not os.path.isdir(folder_path):
-        return "Invalid folder path."
 
-    categorized_files = {}
+def load_file_categories() -> dict[str, str]:
+    try:
+        with open(CATEGORIES_FILE, encoding='utf-8') as file:
+            config = json.load(file)
+    except FileNotFoundError:
+        return FILE_CATEGORIES
+    return {extension.lower(): category for category, extensions in config.items() for extension in extensions}
+
+
+def free_path(folder: str, file_name: str, reserved: set[str]) -> str:     # "name (1).ext" if the name is taken
+    stem, extension = os.path.splitext(file_name)
+    path = os.path.join(folder, file_name)
+    counter = 0
+    while path in reserved or os.path.exists(path):
+        counter += 1
+        path = os.path.join(folder, f'{stem} ({counter}){extension}')
+    reserved.add(path)
+    return path
+
+
+def is_skipped(file_name: str) -> bool:
+    name = file_name.removesuffix('.tmp')
+    return name in SKIPPED_FILES or SKIPPED_SHARD_FILES.fullmatch(name) is not None
+
+
+def plan_file_moves(folder_path: str, recursive: bool = False, categories: dict[str, str] = FILE_CATEGORIES) -> list[tuple[str, str]]:
+    category_folders = {*categories.values(), DEFAULT_CATEGORY, DUPLICATES_FOLDER}
+    reserved = set()
+    plan = []
+    folders = [folder_path]
+    while folders:
+        current = folders.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not (current == folder_path and entry.name in category_folders):
+                        folders.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and not is_skipped(entry.name):
+                    extension = os.path.splitext(entry.name)[1].lower()
+                    category_folder = os.path.join(folder_path, categories.get(extension, DEFAULT_CATEGORY))
+                    plan.append((entry.path, free_path(category_folder, entry.name, reserved)))
+    return plan
+
+
+HEAD_SIZE = 64 * 1024       # bytes hashed first to split same-size files cheaply
+HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(path: str, limit: int | None = None) -> tuple[str, str]:     # runs in worker processes
+    import hashlib
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        if limit is not None:
+            digest.update(file.read(limit))
+        else:
+            for chunk in iter(lambda: file.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+    return path, digest.hexdigest()
+
+
+def group_by_digest(executor, groups: list[list[str]], limit: int | None) -> list[list[str]]:
+    paths = [path for group in groups for path in group]
+    group_of = {path: number for number, group in enumerate(groups) for path in group}
+    result = {}
+    for path, digest in executor.map(file_digest, paths, [limit] * len(paths), chunksize=16):
+        result.setdefault((group_of[path], digest), []).append(path)
+    return [group for group in result.values() if len(group) > 1]
+
+
+def find_duplicates(paths: list[str]) -> list[list[str]]:     # groups of identical files, original first
+    by_size = {}
+    for path in paths:
+        size = os.path.getsize(path)
+        if size:
+            by_size.setdefault(size, []).append(path)
+    candidates = [group for group in by_size.values() if len(group) > 1]
+    if not candidates:
+        return []
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor() as executor:
+        groups = group_by_digest(executor, candidates, HEAD_SIZE)
+        small = [group for group in groups if os.path.getsize(group[0]) <= HEAD_SIZE]
+        large = [group for group in groups if os.path.getsize(group[0]) > HEAD_SIZE]
+        if large:
+            small += group_by_digest(executor, large, None)
+    return sorted(sorted(group) for group in small)
+
+
+def quarantine_duplicates(plan: list[tuple[str, str]], folder_path: str, duplicates: list[list[str]]) -> list[tuple[str, str]]:
+    extra_copies = {path for group in duplicates for path in group[1:]}
+    quarantine = os.path.join(folder_path, DUPLICATES_FOLDER)
+    reserved = {destination for _, destination in plan}
+    return [(source, free_path(quarantine, os.path.basename(source), reserved) if source in extra_copies else destination)
+            for source, destination in plan]
+
+
+def move_file(source: str, destination: str) -> None:
+    try:
+        os.rename(source, destination)      # same filesystem, nothing is copied
+    except OSError:
+        import shutil
+        shutil.move(source, destination)
+
 
-    for file_name in os.listdir(folder_path):
-        if os.path.isfile(os.path.join(folder_path, file_name)):
-            if file_name in ("butler.py", "backup.dat"):
-                continue
+def execute_file_moves(plan: list[tuple[str, str]]) -> list[str]:
+    for folder in {os.path.dirname(destination) for _, destination in plan}:
+        os.makedirs(folder, exist_ok=True)
 
-            file_extension = os.path.splitext(file_name)[1]
-            category = "Other"
-            if file_extension in (".jpg", ".png", ".gif"):
-                category = "Images"
-            elif file_extension in (".doc", ".docx", ".pdf"):
-                category = "Documents"
-            elif file_extension in (".mp4", ".avi", ".mov"):
-                category = "Videos"
+    errors = []
 
-            if category not in categorized_files:
-                categorized_files[category] = []
+    def run(move):
+        try:
+            move_file(*move)
+        except OSError as error:
+            errors.append(f'{move[0]}: {error}')
 
-            categorized_files[category].append(file_name)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=SORT_WORKERS) as executor:
+        for _ in executor.map(run, plan):
+            pass
+    return errors
 
-    if not categorized_files:
-        return "No files found for sorting."
 
-    for category in categorized_files.keys():
-        category_folder = os.path.join(folder_path, category)
-        os.makedirs(category_folder, exist_ok=True)
+def sort_files():
+    folder_path = ask('path',
+        "Enter the absolute path of the folder you want to sort (example: C:\Desktop\project): ")
+    folder_path = folder_path.strip()
 
-    for category, files in categorized_files.items():
-        category_folder = os.path.join(folder_path, category)
-        for file_name in files:
-            source_path = os.path.join(folder_path, file_name)
-            destination_path = os.path.join(category_folder, file_name)
-            shutil.move(source_path, destination_path)
+    if not os.path.isdir(folder_path):
+        return "Invalid folder path."
 
+    recursive = ask('recursive', 'Sort files in subfolders too (Y/N)? ', 'N') in ('Y', 'y')
+    duplicates_mode = ask('duplicates', 'Look for duplicates (N - no, R - report, Q - move to Duplicates)? ', 'N').upper()
+    dry_run = ask('dry_run', 'Only show what would be moved (Y/N)? ', 'N') in ('Y', 'y')
+
+    plan = plan_file_moves(folder_path, recursive, load_file_categories())
+    if not plan:
+        return "No files found for sorting."
+
+    if duplicates_mode in ('R', 'Q'):
+        duplicates = find_duplicates([source for source, _ in plan])
+        for group in duplicates:
+            view.display('Identical files: ' + ', '.join(os.path.relpath(path, folder_path) for path in group))
+        if not duplicates:
+            view.display('No duplicates found.')
+        elif duplicates_mode == 'Q':
+            plan = quarantine_duplicates(plan, folder_path, duplicates)
+
+    if dry_run:
+        for source, destination in plan:
+            view.display(f'{os.path.relpath(source, folder_path)} -> {os.path.relpath(destination, folder_path)}')
+        return f"\n{len(plan)} files would be moved."
+
+    errors = execute_file_moves(plan)
+    if errors:
+        return f"Sorted {len(plan) - len(errors)} files, {len(errors)} failed:\n" + '\n'.join(errors)
     return "File sorting completed successfully."
 
 
@@ -714,15 +2872,21 @@ commands = {
     'close':        (exit_func,             ' -> exit from the bot with or without saving'),
     'save':         (saver,                 ' -> saves to file all changes'),
     'load':         (loader,                ' -> loads last version of the Address Book'),
+    'migrate':      (migrator,              ' -> copies backup.dat into the SQLite database (--storage sqlite), cannot be undone'),
     'help':         (helper,                ' -> shows the list of all supported commands'),
     'add contact':  (contact_adder,         ' -> adds new contact'),
     '+c':           (contact_adder,         ' -> adds new contact (short command)'),
     'show contacts': (show_all_contacts,    ' -> shows all contacts'),
     '?c':           (show_all_contacts,     ' -> shows all contacts (short command)'),
     'search':       (contact_search,        ' -> search for a contact by name'),
+    'fuzzy search': (fuzzy_search_handler,  ' -> best matching contacts by name, email or address, typos allowed'),
+    'who calls':    (caller_finder,         ' -> finds contacts by a phone number written in any format'),
     'modify':       (contact_modifier,      ' -> modify an existing contact'),
     'remove':       (contact_remover,       ' -> remove an existing contact'),
     'to birthdays': (days_to_birthdays,     ' -> days to birthgays'),
+    'undo':         (undo_handler,          ' -> cancels the changes of the last command'),
+    'redo':         (redo_handler,          ' -> brings back the changes cancelled by undo'),
+    'validate':     (book_validator,        ' -> checks all contacts against the phone, email and birthday rules'),
     'add note':     (note_adder,            ' -> adds note with o without hashtag'),
     '+n':           (note_adder,            ' -> adds note with o without hashtag (short command)'),
     'show notes':   (show_all_notes,        ' -> shows all notes'),
@@ -734,29 +2898,322 @@ commands = {
     'sort notes':   (sort_notes_handler,    ' -> sort notes by title'),
     'so':           (sort_notes_handler,    ' -> sort notes by title (short command)'),
     'sort files':   (sort_files,            ' -> sorts files into categories'),
+    'stats':        (stats_handler,         ' -> per-command latency statistics (on/off/export)'),
+    'import':       (importer,              ' -> imports contacts and notes from a .csv or .jsonl file, cannot be undone'),
+    'export':       (exporter,              ' -> exports contacts or notes to a .csv or .jsonl file'),
 }
 
+command_matcher = None     # built by the first unknown_command(), most sessions never need it
+plain_handlers = {key: handler for key, (handler, _) in commands.items()}
 
-def main():
-    print(loader())
-    while True:
-        phrase = input('Please enter command or type "help": ').strip()
-        command = None
-        for key in commands:
-            if phrase.lower() == key:
-                command = key
-                break
 
-        if not command:
-            result = unknown_command(phrase)
+def enable_instrumentation() -> None:      # handlers are only wrapped while statistics are collected
+    stats.enabled = True
+    for key, (_, description) in commands.items():
+        commands[key] = (timed(key)(plain_handlers[key]), description)
+
+
+def disable_instrumentation() -> None:
+    stats.enabled = False
+    for key, (_, description) in commands.items():
+        commands[key] = (plain_handlers[key], description)
+
+
+commands_by_length = sorted(commands, key=len, reverse=True)
+
+
+def parse_command(line: str) -> tuple[str, dict[str, list[str]]] | None:   # "add contact name=Bob phone=..."
+    lowered = line.lower()
+    if lowered in commands:
+        return lowered, {}
+    for key in commands_by_length:
+        if lowered.startswith(key + ' '):
+            answers = {}
+            for token in shlex.split(line[len(key):]):
+                name, separator, value = token.partition('=')
+                if not separator:
+                    raise ValueError(f'argument "{token}" should look like name=value')
+                answers.setdefault(name.lower(), []).append(value)
+            return key, answers
+    return None
+
+
+def dispatch(line: str, interactive: bool = True) -> str:
+    try:
+        parsed = parse_command(line)
+    except ValueError as error:
+        return f'\n{error}\n'
+    if parsed is None:
+        return unknown_command(line)
+
+    key, answers = parsed
+    try:
+        return run_command(key, None if interactive and not answers else answers)
+    except MissingArgument as error:
+        return f'\nMissing argument {error}=... for "{key}"\n'
+    except ValueError as error:
+        return f'\nWrong value: {error}\n'
+
+
+BULK_COMMANDS = {'import', 'migrate'}   # may change the whole book, so they cannot be undone
+
+
+def run_command(key: str, answers: dict[str, list[str]] | None, output: DisplayView = console) -> str:
+    global prompter, view
+    with book_lock:     # prompter and view are shared, the server runs commands from several threads
+        prompter = Prompter(answers)
+        view = output
+        try:
+            with address_book.bulk_changes() if key in BULK_COMMANDS else address_book.changes():
+                return commands[key][0]()
+        finally:
+            prompter = Prompter()
+            view = console
+
+
+def run_script(lines) -> None:      # changes of the whole script are saved once, at the end
+    console.display(loader())
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or line.lower() == 'save':
+            continue
+        result = dispatch(line, interactive=False)
+        console.display(result)
+        if result == 'Goodbye!\n':     # "exit" has already asked whether to save
+            break
+    else:
+        if journal.unsaved:
+            console.display(saver())
+    console.flush()
+
+
+# Network server
+
+
+READ_COMMANDS = {'hello', 'help', 'stats', 'search', 'fuzzy search', 'who calls', 'show contacts', '?c', 'to birthdays',
+                 'validate', 'show notes', '?n', 'search notes', '?s', 'search hashtag', '?h', 'sort notes', 'so'}
+SERVER_BLOCKED_COMMANDS = {'sort files', 'import', 'export', 'migrate'}    # no access to the server's files
+SERVER_BLOCKED_ACTIONS = {'stats': ('action', 'export')}    # command -> argument value that writes a server file
+SERVER_EXIT_COMMANDS = {'exit', 'close'}
+
+
+class BookServer:
+    # Requests are "add contact name=Bob ..." lines or {"command": ..., "args": {...}} objects, one per line;
+    # every response is one JSON line. Writes go through a single writer task, in the order they came. Commands
+    # and saves run in worker threads, one at a time under book_lock, so a slow one or an fsync does not stop
+    # the event loop from reading and answering other clients meanwhile.
+    def __init__(self) -> None:
+        import asyncio
+        self.writes = asyncio.Queue()
+
+    @staticmethod
+    def parse_request(line: str) -> tuple[str, dict[str, list[str]]]:
+        if line.startswith('{'):
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request should be a JSON object')
+            key = str(request.get('command', '')).lower()
+            if key not in commands:
+                raise ValueError(f'unknown command "{key}"')
+            args = request.get('args') or {}
+            if not isinstance(args, dict):
+                raise ValueError('"args" should be an object of name: value')
+            answers = {}
+            for name, value in args.items():
+                answers[name.lower()] = [str(item) for item in value] if isinstance(value, list) else [str(value)]
+            return key, answers
+        parsed = parse_command(line)
+        if parsed is None:
+            raise ValueError(unknown_command(line).strip())
+        return parsed
+
+    @staticmethod
+    def execute(key: str, answers: dict[str, list[str]]) -> dict:
+        output = CollectingView()
+        try:
+            result = run_command(key, answers, output)
+        except MissingArgument as error:
+            return {'ok': False, 'result': f'Missing argument {error}=... for "{key}"'}
+        except ValueError as error:
+            return {'ok': False, 'result': f'Wrong value: {error}'}
+        except Exception as error:      # a bug in one command must not take the server down
+            console.display(f'\n"{key}" failed: {error!r}\n')
+            console.flush()
+            return {'ok': False, 'result': f'"{key}" failed: {error}'}
+        output.display(result)
+        return {'ok': True, 'result': output.text()}
+
+    async def handle_request(self, line: str) -> dict:
+        try:
+            key, answers = self.parse_request(line)
+        except ValueError as error:
+            return {'ok': False, 'result': str(error)}
+        if key in SERVER_EXIT_COMMANDS:
+            return {'ok': True, 'result': 'Goodbye!', 'bye': True}
+        if key in SERVER_BLOCKED_COMMANDS:
+            return {'ok': False, 'result': f'"{key}" is not available over the network'}
+        if key in SERVER_BLOCKED_ACTIONS:
+            name, value = SERVER_BLOCKED_ACTIONS[key]
+            if any(answer.strip().lower() == value for answer in answers.get(name, ())):
+                return {'ok': False, 'result': f'"{key} {name}={value}" is not available over the network'}
+        import asyncio
+        if key in READ_COMMANDS:
+            return await asyncio.get_running_loop().run_in_executor(None, self.execute, key, answers)
+        done = asyncio.get_running_loop().create_future()
+        await self.writes.put((key, answers, done))
+        return await done
+
+    async def write_loop(self) -> None:
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            key, answers, done = await self.writes.get()
+            response = await loop.run_in_executor(None, self.execute, key, answers)
+            if self.writes.empty() and journal.unsaved:
+                try:
+                    await loop.run_in_executor(None, saver)     # everything written since the queue was last empty
+                except Exception as error:
+                    console.display(f'\nSaving failed: {error}\n')
+                    console.flush()
+                    response = {'ok': False, 'result': f'{response["result"]}\nThe change is not saved: {error}'}
+            if not done.done():     # the client may be gone
+                done.set_result(response)
+
+    async def handle_client(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter') -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                response = await self.handle_request(line)
+                writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+                if response.get('bye'):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        import asyncio
+        listener = await asyncio.start_server(self.handle_client, host, port)
+        writer_task = asyncio.create_task(self.write_loop())
+        console.display(f'Serving the address book on {host}:{port}')
+        console.flush()
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            writer_task.cancel()
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description='Address book and notes assistant')
+    parser.add_argument('--script', metavar='FILE',
+                        help='run commands from FILE ("-" for stdin), e.g. "add contact name=Bob phone=+38(099)1234567"')
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help='serve the address book over TCP instead of the interactive prompt')
+    parser.add_argument('--stats', action='store_true',
+                        help='collect per-command latency statistics from the start, see the "stats" command')
+    parser.add_argument('--storage', choices=('pickle', 'sqlite'), default='pickle',
+                        help=f'keep the book in {BACKUP_FILE} (default) or in the {DATABASE_FILE} SQLite database')
+    parser.add_argument('--compress', choices=('zlib', 'lzma'),
+                        help=f'compress new {BACKUP_FILE} snapshots, compressed or not they are always readable')
+    parser.add_argument('--autosave', metavar='SECONDS', type=float, nargs='?', const=AUTOSAVE_INTERVAL,
+                        help=f'save changes in the background every SECONDS (default {AUTOSAVE_INTERVAL}) '
+                             f'or after {AUTOSAVE_CHANGES} changes')
+    parser.add_argument('--shards', metavar='N', type=int,
+                        help=f'split the book between N processes and files ({SHARD_FILE.format("N")}), '
+                             f'each saved on its own; searches run in all of them at once')
+    parser.add_argument('--remind', metavar='DAYS', type=int, nargs='?', const=0,
+                        help='remind of birthdays as they come, or DAYS before them (interactive and --serve)')
+    args = parser.parse_args(argv)
+
+    global storage, journal, autosaver, reminders
+    if args.shards is not None:
+        saved = ShardedStorage.saved_count()
+        if args.storage == 'sqlite':
+            parser.error('--shards keeps the book in its own files, it cannot be used with --storage sqlite')
+        elif args.shards < 1:
+            parser.error('--shards needs at least 1 shard')
+        elif saved is not None and saved != args.shards:
+            parser.error(f'the saved book is split into {saved} shards, start with --shards {saved}')
+        journal = Journal(None)     # shards keep journals of their own
+        storage = ShardedStorage(args.shards, journal, args.compress)
+    elif args.storage == 'sqlite':
+        journal = Journal(None)     # changes are already in the open transaction
+        storage = SQLiteStorage(DATABASE_FILE, journal)
+    else:
+        storage = PickleStorage(BACKUP_FILE, journal, args.compress)
+
+    if args.stats:
+        enable_instrumentation()
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        console.display(loader())
+        if args.remind is not None:
+            reminders = BirthdayReminders(args.remind)
+            reminders.watch(address_book)
+            reminders.start()
+        import asyncio
+        try:
+            asyncio.run(BookServer().serve(host or '127.0.0.1', int(port)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if journal.unsaved:
+                console.display(saver())
+            console.flush()
+        return
+
+    if args.script:
+        if args.script == '-':
+            run_script(sys.stdin)
+        else:
+            with open(args.script, encoding='utf-8') as file:
+                run_script(file)
+        return
+
+    prompt = 'Please enter command or type "help": '
+    loading = BackgroundLoader()
+    while True:
+        if loading is not None:
+            console.display(prompt, end='')
+            console.flush()     # the prompt is out before the saved book starts loading
+            loading.start()
+            phrase = input().strip()
+            loading.join()
+            if loading.message:
+                console.display(loading.message)
+            loading = None
+            if args.autosave:
+                autosaver = Autosaver(args.autosave)
+                autosaver.start()
+            if args.remind is not None:
+                reminders = BirthdayReminders(args.remind)
+                reminders.watch(address_book)
+                reminders.start()
         else:
-            handler = commands.get(command)[0]
-            result = handler()
-            if result == 'Goodbye!\n':
-                print(result)
-                break
-        print(result)
+            console.flush()
+            phrase = input(prompt).strip()
+        result = dispatch(phrase)
+        if autosaver is not None:
+            autosaver.changed()
+        if result == 'Goodbye!\n':
+            console.display(result)
+            break
+        console.display(result)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        console.flush()
+        if isinstance(address_book, ShardedAddressBook):
+            address_book.close()    # shard processes stop before interpreter exit, it can hang on busy ones
\ No newline at end of file
@@ -0,0 +1,198 @@
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import date, timedelta
+
+import Assistant_bot as bot
+
+
+FIRST_NAMES = ('Olena', 'Andrii', 'Iryna', 'Taras', 'Oksana', 'Dmytro', 'Nataliia', 'Serhii', 'Yulia', 'Bohdan',
+               'Mariia', 'Oleh', 'Sofiia', 'Maksym', 'Kateryna', 'Ivan', 'Anna', 'Petro', 'Daryna', 'Roman')
+LAST_NAMES = ('Shevchenko', 'Kovalenko', 'Bondarenko', 'Tkachenko', 'Kravchenko', 'Melnyk', 'Boiko', 'Lysenko',
+              'Moroz', 'Savchenko', 'Rudenko', 'Marchenko', 'Petrenko', 'Klymenko', 'Pavlenko', 'Levchenko')
+STREETS = ('Khreshchatyk', 'Sichovykh Striltsiv', 'Velyka Vasylkivska', 'Saksahanskoho', 'Antonovycha', 'Lvivska')
+CITIES = ('Kyiv', 'Lviv', 'Odesa', 'Kharkiv', 'Dnipro', 'Poltava')
+DOMAINS = ('gmail.com', 'ukr.net', 'mail.com', 'meta.ua', 'i.ua')
+OPERATORS = ('050', '063', '066', '067', '068', '073', '093', '095', '096', '097', '098', '099')
+WORDS = ('call', 'buy', 'meeting', 'project', 'report', 'milk', 'bread', 'doctor', 'friday', 'invoice', 'deploy',
+         'review', 'birthday', 'gift', 'ticket', 'train', 'budget', 'plan', 'release', 'python', 'backup', 'travel')
+TAGS = ('todo', 'work', 'home', 'shopping', 'ideas', 'health', 'travel', 'books', 'finance', 'study')
+FILE_TYPES = ('.jpg', '.png', '.gif', '.doc', '.docx', '.pdf', '.mp4', '.avi', '.mov', '.txt', '.zip', '.py')
+
+
+def generate_book(size: int, seed: int = 0) -> bot.AddressBook:
+    rng = random.Random(seed)
+    book = bot.AddressBook()
+    today = date.today()
+    for i in range(size):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        record = bot.Record(bot.Name(f'{first} {last} {i}'))
+        if rng.random() < 0.8:
+            record.add_address(bot.Address(f'{rng.choice(CITIES)}, {rng.choice(STREETS)} {rng.randint(1, 200)}'))
+        for _ in range(rng.choice((0, 1, 1, 1, 2))):
+            record.add_phone(bot.Phone(f'+38({rng.choice(OPERATORS)}){rng.randint(1000000, 9999999)}'))
+        if rng.random() < 0.7:
+            record.add_email(bot.Email(f'{first.lower()}.{last.lower()}{i}@{rng.choice(DOMAINS)}'))
+        if rng.random() < 0.6:
+            record.add_birthday(bot.Birthday(today - timedelta(days=rng.randint(18 * 365, 90 * 365))))
+        book.add_record(record)
+
+    for i in range(max(1, size // 10)):
+        notice = bot.Notice(bot.Hashtag(f'#{rng.choice(TAGS)}{i}'))
+        book.add_notice(notice)
+        for _ in range(rng.randint(1, 3)):
+            notice.add_note(' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))))
+    return book
+
+
+def generate_files(folder: str, count: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for i in range(count):
+        with open(os.path.join(folder, f'file{i}{rng.choice(FILE_TYPES)}'), 'wb') as file:
+            file.write(os.urandom(rng.randint(0, 4096)))
+
+
+def summarize(timings: list[float]) -> dict:
+    return {'runs': len(timings), 'min': min(timings), 'median': statistics.median(timings), 'max': max(timings)}
+
+
+def measure(function, repeat: int, setup=None) -> dict:
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+BOT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+PROMPT = b'Please enter command'
+
+
+def time_to_prompt(arguments: list[str], workdir: str) -> float:    # from starting the interpreter to the first prompt
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, *arguments], cwd=workdir, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, env={**os.environ, 'PYTHONPATH': BOT_FOLDER})
+    output = b''
+    while PROMPT not in output:
+        chunk = process.stdout.read1(4096)
+        if not chunk:
+            break
+        output += chunk
+    elapsed = time.perf_counter() - start
+    process.communicate(b'exit\nN\n')
+    return elapsed
+
+
+def command(key: str, **answers):
+    return lambda: bot.run_command(key, {name: [value] for name, value in answers.items()}, bot.CollectingView())
+
+
+def run_benchmarks(size: int, repeat: int, workdir: str) -> list[dict]:
+    results = []
+
+    def record(name, function, setup=None):
+        results.append({'size': size, 'benchmark': name, **measure(function, repeat, setup)})
+
+    start = time.perf_counter()
+    bot.address_book = generate_book(size)
+    elapsed = time.perf_counter() - start
+    results.append({'size': size, 'benchmark': 'generate_book', 'runs': 1, 'min': elapsed, 'median': elapsed, 'max': elapsed})
+    sample = list(bot.address_book.records)[size // 2]
+
+    record('contact_search (index build)', command('search', query='shev'), bot.address_book._build_indexes)
+    record('contact_search', command('search', query='shev'))
+    record('contact_search (rare)', command('search', query=sample))
+    record('days_to_birthdays', command('to birthdays', days='7'))
+    record('note_searcher', lambda: bot.address_book.note_searcher('deploy review'))
+    record('hashtag_searcher', lambda: bot.address_book.hashtag_searcher('#wor'))
+    record('sort_notes', bot.address_book.sort_notes)
+    record('unknown_command', lambda: bot.unknown_command('serch notes'))
+
+    os.chdir(workdir)
+
+    def fresh_snapshot():
+        bot.journal.clear()
+        if os.path.exists(bot.BACKUP_FILE):
+            os.remove(bot.BACKUP_FILE)
+
+    def one_change():
+        bot.commit_record(bot.address_book.records[sample])
+
+    record('saver (snapshot)', bot.saver, fresh_snapshot)
+    record('saver (one change)', bot.saver, one_change)
+    record('loader', bot.loader)
+    record('loader + first search', lambda: (bot.loader(), bot.address_book.search_records('shev')))
+
+    for name, arguments in (('time to prompt (script)', [os.path.join(BOT_FOLDER, 'Assistant_bot.py')]),
+                            ('time to prompt (-m)', ['-m', 'Assistant_bot'])):
+        results.append({'size': size, 'benchmark': name,
+                        **summarize([time_to_prompt(arguments, workdir) for _ in range(repeat)])})
+
+    files = min(size, 5000)
+    folder = os.path.join(workdir, 'files')
+
+    def fresh_folder():
+        if os.path.exists(folder):
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    os.remove(os.path.join(root, name))
+        os.makedirs(folder, exist_ok=True)
+        generate_files(folder, files)
+
+    record(f'sort_files ({files} files)', command('sort files', path=folder), fresh_folder)
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description='Benchmarks for Assistant_bot on synthetic address books')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='number of contacts in each generated book (1k - 10M)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every benchmark')
+    parser.add_argument('--output', default='bench_output.json', help='where to write the JSON results')
+    parser.add_argument('--label', default=None, help='version label stored with the results (default: git revision)')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    report = {
+        'label': args.label or git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': date.today().isoformat(),
+        'results': [],
+    }
+    cwd = os.getcwd()
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            try:
+                results = run_benchmarks(size, args.repeat, workdir)
+            finally:
+                os.chdir(cwd)
+        for result in results:
+            print(f'{result["size"]:>10} {result["benchmark"]:<32} {result["median"] * 1000:>12.3f} ms')
+        report['results'] += results
+
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
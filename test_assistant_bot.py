@@ -0,0 +1,532 @@
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import Assistant_bot as bot
+
+
+SYLLABLES = ('an', 'na', 'ol', 'ena', 'ser', 'hiy', 'ko', 'var', 'mar', 'ia', 'pet', 'ro', 'shev', 'chen')
+STREETS = ('Khreshchatyk', 'Sadova', 'Shevchenka', 'Lvivska', 'Naberezhna')
+
+
+def random_word(rng: random.Random) -> str:
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+
+
+def random_record(rng: random.Random, name: str) -> bot.Record:
+    phones = [bot.Phone(f'+38(0{rng.randint(50, 99)}){rng.randint(0, 50):07d}') for _ in range(rng.randint(0, 2))]
+    address = bot.Address(f'{rng.choice(STREETS)} {rng.randint(1, 99)}') if rng.random() < 0.7 else None
+    email = bot.Email(f'{name.split()[0].lower()}@ukr.net') if rng.random() < 0.5 else None
+    birthday = bot.Birthday(date(1960, 1, 1) + timedelta(days=rng.randint(0, 20000))) if rng.random() < 0.8 else None
+    if rng.random() < 0.05:
+        birthday = bot.Birthday(date(1996, 2, 29))
+    return bot.Record(bot.Name(name), address, phones, email, birthday)
+
+
+def random_notice(rng: random.Random) -> bot.Notice:
+    notice = bot.Notice(bot.Hashtag('#' + random_word(rng)))
+    for _ in range(rng.randint(1, 3)):
+        notice.add_note(bot.Note(' '.join(random_word(rng) for _ in range(rng.randint(1, 5)))))
+    return notice
+
+
+def change_book(book: bot.AddressBook, rng: random.Random, steps: int) -> None:
+    # adds, renames, edits and removals of contacts and notes, the way the handlers make them
+    for _ in range(steps):
+        names = list(book.records)
+        action = rng.random()
+        if action < 0.4 or not names:
+            name = f'{random_word(rng).title()} {random_word(rng).title()}'
+            book.add_record(random_record(rng, name))
+        elif action < 0.55:
+            old_name = rng.choice(names)
+            record = book.records[old_name].copy()
+            record.name = bot.Name(f'{random_word(rng).title()} {random_word(rng).title()}')
+            book.update_record(record, old_name)
+        elif action < 0.75:
+            name = rng.choice(names)
+            record = random_record(rng, name)
+            record.phones = list(book.records[name].phones) + record.phones[:1]
+            book.add_record(record)
+        elif action < 0.85:
+            book.remove_record(rng.choice(names))
+        elif action < 0.95 or not book.notes:
+            book.add_notice(random_notice(rng))
+        else:
+            book.remove_notice(rng.choice(list(book.notes)))
+
+
+def names(records) -> list[str]:
+    return [record.name.name for record in records]
+
+
+def changed_books(seed: int, rounds: int = 6, steps: int = 60):     # the same book after every round of changes
+    rng = random.Random(seed)
+    book = bot.AddressBook()
+    for _ in range(rounds):
+        change_book(book, rng, steps)
+        yield book, rng
+
+
+def records_words(book: bot.AddressBook) -> list[str]:
+    return [word for record in book.records.values() for word in book._fuzzy_words(record)]
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_search_matches_a_full_scan(seed):
+    for book, rng in changed_books(seed):
+        words = records_words(book)
+        queries = ['an', 'ena', 'sadova', '@ukr', '(099)', '1970-0'] + [word[1:5] for word in rng.sample(words, min(5, len(words)))]
+        for query in queries:
+            expected = [record for record in book.records.values()
+                        if any(query.lower() in field for field in book._search_fields(record))]
+            assert names(book.search_records(query)) == names(expected), query
+
+
+def book_state(book: bot.AddressBook) -> tuple[list[str], list[str]]:    # undo puts a removed contact last
+    return (sorted(str(record) for record in book.records.values()),
+            sorted(notice.hashtag.hashtag + ': ' + ' | '.join(note.note for note in notice.notes)
+                   for notice in book.notes.values()))
+
+
+def logged_changes(book: bot.AddressBook, rng: random.Random, steps: int) -> None:
+    with book.changes():
+        change_book(book, rng, steps)
+    bot.log_changes(book._undo[-1])
+
+
+def test_save_load_and_journal_replay(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, 'JOURNAL_LIMIT', 10**6)   # later saves only append to the journal
+    monkeypatch.setattr(bot, 'journal', bot.Journal(bot.JOURNAL_FILE))
+    rng = random.Random(4)
+    storage = bot.PickleStorage(bot.BACKUP_FILE, bot.journal)
+    assert storage.load() is None
+
+    book = bot.AddressBook()
+    logged_changes(book, rng, 80)
+    storage.save(book)
+    assert not (tmp_path / bot.JOURNAL_FILE).exists()
+
+    for _ in range(3):
+        logged_changes(book, rng, 30)
+        storage.save(book)
+    assert bot.journal.size > 0 and not bot.journal.pending
+
+    loaded = bot.PickleStorage(bot.BACKUP_FILE, bot.Journal(bot.JOURNAL_FILE)).load()
+    assert book_state(loaded) == book_state(book)
+    assert names(loaded.search_records('an')) == names(book.search_records('an'))
+
+
+def test_torn_journal_tail_is_dropped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = bot.Journal(bot.JOURNAL_FILE)
+    storage = bot.PickleStorage(bot.BACKUP_FILE, journal)
+    book = bot.AddressBook()
+    storage.save(book)
+    journal.log('add_record', bot.Record(bot.Name('Ann')))
+    journal.log('add_record', bot.Record(bot.Name('Bob')))
+    storage.save(book)
+    with open(bot.JOURNAL_FILE, 'r+b') as file:     # a save interrupted in the middle of the last entry
+        file.truncate(file.seek(0, 2) - 5)
+
+    loaded = bot.PickleStorage(bot.BACKUP_FILE, bot.Journal(bot.JOURNAL_FILE)).load()
+    assert list(loaded.records) == ['Ann']
+
+
+def next_birthdays(book: bot.AddressBook, today: date, days: int) -> list[str]:
+    # day by day from today, Feb 29 birthdays on Feb 28 of common years
+    result = []
+    for offset in range(min(days, 365) + 1):
+        day = today + timedelta(days=offset)
+        celebrated = {(day.month, day.day)}
+        if (day.month, day.day) == (2, 28) and not bot.isleap(day.year):
+            celebrated.add((2, 29))
+        result += sorted((bot.day_of_year(record.birthday.birthday), name) for name, record in book.records.items()
+                         if record.birthday is not None
+                         and (record.birthday.birthday.month, record.birthday.birthday.day) in celebrated)
+    return list(dict.fromkeys(name for _, name in result))
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_upcoming_birthdays_match_a_day_by_day_scan(seed):
+    for book, _ in changed_books(seed):
+        for today in (date(2023, 2, 20), date(2024, 2, 20), date(2023, 12, 25), date(2024, 6, 1)):
+            for days in (0, 7, 30, 200, 365):
+                assert names(book.upcoming_birthdays(days, today)) == next_birthdays(book, today, days), (today, days)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_sqlite_upcoming_birthdays_match_a_plain_book(seed):
+    rng = random.Random(seed)
+    plain = bot.AddressBook()
+    book = bot.SQLiteAddressBook(sqlite3.connect(':memory:'))
+    for i in range(150):
+        record = random_record(rng, f'{random_word(rng).title()} {i}')
+        plain.add_record(record)
+        book.add_record(record)
+    for today in (date(2023, 2, 20), date(2024, 2, 20), date(2023, 12, 25)):
+        for days in (0, 7, 30, 365):
+            assert names(book.upcoming_birthdays(days, today)) == names(plain.upcoming_birthdays(days, today))
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_note_search_matches_a_full_scan(seed):
+    for book, rng in changed_books(seed):
+        notes = [note for notice in book.notes.values() for note in notice.notes]
+        for keyword in ['an', 'ser ko', 'zzz'] + [random_word(rng)[:3] for _ in range(5)]:
+            terms = set(bot.tokenize(keyword))
+            expected = [note.note for note in notes
+                        if all(any(token.startswith(term) for token in bot.tokenize(note.note)) for term in terms)]
+            assert sorted(note.note for note in book.note_searcher(keyword)) == sorted(expected), keyword
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_who_calls_matches_a_full_scan(seed):
+    for book, _ in changed_books(seed):
+        phones = [phone.phone for record in book.records.values() for phone in record.phones][:10] + ['+38(099)0000001']
+        for phone in phones + ['0' + phone[4:7] + ' ' + phone[8:] for phone in phones]:  # also as 099 1234567
+            key = bot.normalize_phone(phone)
+            expected = [record for record in book.records.values()
+                        if any(bot.normalize_phone(p.phone) == key for p in record.phones)]
+            assert sorted(names(book.who_calls(phone))) == sorted(names(expected)), phone
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def empty_book(request):
+    if request.param == 'memory':
+        yield bot.AddressBook()
+    else:
+        connection = sqlite3.connect(':memory:')
+        yield bot.SQLiteAddressBook(connection)
+        connection.close()
+
+
+def test_undo_redo_round_trip(empty_book):
+    rng = random.Random(5)
+    book = empty_book
+    states = [book_state(book)]
+    for _ in range(8):
+        with book.changes():
+            change_book(book, rng, 6)
+        states.append(book_state(book))
+
+    for state in reversed(states[:-1]):
+        assert book.undo() is not None
+        assert book_state(book) == state
+    assert book.undo() is None
+
+    for state in states[1:]:
+        assert book.redo() is not None
+        assert book_state(book) == state
+    assert book.redo() is None
+
+    with book.changes():
+        change_book(book, rng, 3)
+    assert book.redo() is None      # a new change drops what could be redone
+
+
+def test_snapshot_keeps_its_version():
+    rng = random.Random(6)
+    book = bot.AddressBook()
+    change_book(book, rng, 40)
+    before = {name: str(record) for name, record in book.records.items()}
+    snapshot = book.snapshot()
+    change_book(book, rng, 40)
+    assert {name: str(record) for name, record in snapshot.records.items()} == before
+
+
+@pytest.mark.parametrize('text', ['2000.01.05', '2000.1.5', '1996.02.29', '2000. 1.05', '2000.+1.05', '2000.-1.05',
+                                  '2000.01.5 ', '２０００.01.05', '2000.02.30', '2000-01-05', '', '3000.01.01'])
+def test_birthday_accepts_what_the_validators_accept(text):
+    try:
+        expected = datetime.strptime(text, '%Y.%m.%d').date()
+    except ValueError:
+        expected = None
+    assert bot.parse_date(text) == expected
+    assert bot.parse_birthdays([text]) == [expected if bot.Birthday.date_validator(text) else None]
+    if bot.Birthday.date_validator(text):
+        assert bot.Birthday(text).birthday == expected
+    elif expected is None:
+        with pytest.raises(ValueError):
+            bot.Birthday(text)
+
+
+def test_batch_validators_agree_with_the_single_ones():
+    phones = ['+38(099)1234567', '+38(099)123456', '380991234567', '+38(099)12345678', '']
+    emails = ['olena@ukr.net', 'o@ukr.net', '1olena@ukr.net', 'olena@ukr', 'olena.s@mail.com']
+    assert bot.validate_phones(phones) == [bool(bot.Phone.phone_validator(phone)) for phone in phones]
+    assert bot.validate_emails(emails) == [bool(bot.Email.email_validator(email)) for email in emails]
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_fuzzy_search_matches_a_full_scan(seed):
+    for book, rng in changed_books(seed):
+        words = records_words(book)
+        for query in [random_word(rng) for _ in range(5)] + [rng.choice(words)[:-1] + 'x' for _ in range(3)]:
+            terms = bot.fuzzy_terms(query)
+            expected = {record.name.name for record in book.records.values()
+                        if any(bot.edit_distance(term, word) <= bot.fuzzy_tolerance(term)
+                               for term in terms for word in book._fuzzy_words(record))}
+            assert set(names(book.fuzzy_search(query, len(book.records) + 1))) == expected, query
+
+
+def test_fuzzy_search_ranks_all_terms_and_caps_them():
+    book = bot.AddressBook()
+    for name in ('Olena Shevchenko', 'Olena Petrenko', 'Oleg Shevchuk'):
+        book.add_record(bot.Record(bot.Name(name)))
+    assert names(book.fuzzy_search('olena shevchneko', 1)) == ['Olena Shevchenko']
+    query = ' '.join(f'zzz{letter}' for letter in 'abcdefghijklmnopqrst'[:bot.FUZZY_TERMS])
+    assert names(book.fuzzy_search(query + ' olena', 5)) == []     # words after the first FUZZY_TERMS are ignored
+
+
+def test_record_edited_in_place_is_unindexed():
+    book = bot.AddressBook()
+    record = bot.Record(bot.Name('Ann'), phone=[bot.Phone('+38(099)1234567')])
+    book.add_record(record)
+    book.search_records('ann')
+    record.add_email(bot.Email('zoe@mail.com'))
+    record.add_phone(bot.Phone('+38(099)7654321'))
+    book.remove_record('Ann')
+    assert not book.records and not book._order
+    assert book.fuzzy_search('ann') == [] and book.fuzzy_search('zoe') == []
+    assert book.who_calls('0991234567') == [] and book.search_records('ann') == []
+
+
+@pytest.fixture
+def sharded_storage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)     # shard processes start here and keep their files here
+    storage = bot.ShardedStorage(3, bot.Journal(bot.JOURNAL_FILE))
+    yield storage
+    storage.book.close()
+
+
+def assert_same_order(book: bot.AddressBook, plain: bot.AddressBook) -> None:
+    assert list(book.records) == list(plain.records) and list(book.notes) == list(plain.notes)
+    assert [str(record) for record in book.records.values()] == [str(record) for record in plain.records.values()]
+    for query in ('an', 'ser', 'ko'):
+        assert names(book.search_records(query)) == names(plain.search_records(query)), query
+    phone = next(phone.phone for record in plain.records.values() for phone in record.phones)
+    assert names(book.who_calls(phone)) == names(plain.who_calls(phone))
+
+
+def test_sharded_book_keeps_the_order_of_a_plain_book(sharded_storage):
+    plain, sharded = bot.AddressBook(), sharded_storage.load()
+    change_book(plain, random.Random(7), 80)
+    change_book(sharded, random.Random(7), 80)
+    assert_same_order(sharded, plain)
+    sharded_storage.save(sharded)
+    assert_same_order(sharded_storage.load(), plain)
+
+
+def test_failed_shard_change_raises_before_undo_sees_it(sharded_storage):
+    book = sharded_storage.load()
+    notice = bot.Notice(bot.Hashtag('#broken'))
+    notice.notes.append(bot.Note(5))        # the shard fails to index it
+    with pytest.raises(AttributeError):
+        with book.changes():
+            book.add_notice(notice)
+    assert book.undo() is None
+
+
+def test_import_into_sqlite_keeps_no_records_for_undo_or_saving(tmp_path, monkeypatch):
+    book = bot.SQLiteAddressBook(sqlite3.connect(':memory:'))
+    monkeypatch.setattr(bot, 'address_book', book)
+    monkeypatch.setattr(bot, 'journal', bot.Journal(None))
+    with book.changes():
+        book.add_record(bot.Record(bot.Name('Ann')))
+    path = tmp_path / 'contacts.jsonl'
+    path.write_text(''.join(json.dumps({'name': f'Contact {i}'}) + '\n' for i in range(50)), encoding='utf-8')
+    bot.run_command('import', {'path': [str(path)]})
+    assert len(book.records) == 51
+    assert bot.journal.unsaved == 50 and not bot.journal.pending
+    assert not book._undo and book.undo() is None       # neither the import nor what came before can be undone
+
+
+def test_import_rejects_values_that_are_not_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'address_book', bot.AddressBook())
+    monkeypatch.setattr(bot, 'journal', bot.Journal(None))
+    rows = [{'name': ['x']}, {'name': 'Ann', 'address': 5}, {'name': 'Bob', 'phones': [380501234567]},
+            {'name': 'Eve', 'email': {'a': 1}}, {'hashtag': 5, 'note': 'x'}, {'hashtag': '#a', 'note': [1]},
+            {'name': 'Olena', 'address': 'Sadova 1', 'phones': '+38(050)1234567', 'birthday': '1990.05.17'}]
+    path = tmp_path / 'rows.jsonl'
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows), encoding='utf-8')
+    view = bot.CollectingView()
+    assert 'Imported 1 rows, skipped 6 rows' in bot.run_command('import', {'path': [str(path)]}, view)
+    assert view.lines == ['Row 1: "name" should be a text', 'Row 2: "address" should be a text',
+                          'Row 3: "phones" should be a list of texts or a ";"-separated text',
+                          'Row 4: "email" should be a text', 'Row 5: "hashtag" should be a text',
+                          'Row 6: "note" should be a text or a list of texts']
+    book = bot.address_book
+    assert list(book.records) == ['Olena'] and not book.notes
+    assert not book._unindexed      # indexed by the import, not by the next search
+    assert names(book.search_records('sadova')) == ['Olena']
+
+
+class CountingStorage(bot.Storage):     # keeps nothing, counts saves, each taking delay seconds as an fsync may
+    def __init__(self, delay: float = 0) -> None:
+        super().__init__('memory', bot.Journal(None))
+        self.delay = delay
+        self.saves = 0
+
+    def load(self):
+        return None
+
+    def save(self, book):
+        time.sleep(self.delay)
+        self.saves += 1
+
+
+def test_server_answers_other_clients_while_saving(monkeypatch):
+    import asyncio
+    storage = CountingStorage(0.3)
+    monkeypatch.setattr(bot, 'address_book', bot.AddressBook())
+    monkeypatch.setattr(bot, 'journal', storage.journal)
+    monkeypatch.setattr(bot, 'storage', storage)
+
+    async def session():
+        server = bot.BookServer()
+        writer_task = asyncio.create_task(server.write_loop())
+        write = asyncio.create_task(server.handle_request('add contact name=Bob phone=+38(099)1234567'))
+        await asyncio.sleep(0.1)        # Bob is added, the save is running
+        answer = await server.handle_request('no such command')
+        saving = not write.done()
+        added = await write
+        found = await server.handle_request('search query=bob')
+        writer_task.cancel()
+        return answer, saving, added, found
+
+    answer, saving, added, found = asyncio.run(session())
+    assert not answer['ok'] and saving
+    assert added['ok'] and storage.saves == 1
+    assert found['ok'] and 'Bob' in found['result']
+
+
+def test_inline_arguments():
+    key, answers = bot.parse_command('Add Contact name="Anna Maria" Phone=+38(099)1234567 phone=+38(050)7654321')
+    assert key == 'add contact'
+    assert answers == {'name': ['Anna Maria'], 'phone': ['+38(099)1234567', '+38(050)7654321']}
+    assert bot.parse_command('hello') == ('hello', {})
+    assert bot.parse_command('no such command') is None
+    with pytest.raises(ValueError):
+        bot.parse_command('search bob')
+
+
+@pytest.mark.parametrize('last_line, saves', [('', 1), ('exit save=n', 0), ('exit save=y', 1)])
+def test_script_saves_once_unless_exit_declines(monkeypatch, last_line, saves):
+    storage = CountingStorage()
+    monkeypatch.setattr(bot, 'address_book', bot.AddressBook())
+    monkeypatch.setattr(bot, 'journal', storage.journal)
+    monkeypatch.setattr(bot, 'storage', storage)
+    lines = ['# contacts', 'add contact name=Bob phone=+38(099)1234567', 'save', 'add contact name=Ann',
+             'search query=bob', last_line]
+    bot.run_script(lines)
+    assert names(bot.address_book.records.values()) == ['Bob', 'Ann']
+    assert storage.saves == saves
+
+
+def test_reminders_are_scheduled_for_the_next_birthday():
+    reminders = bot.BirthdayReminders(ahead=3, output=bot.CollectingView())
+    reminders._schedule('Leap', date(1996, 2, 29), date(2023, 1, 10))
+    reminders._schedule('Late', date(1990, 1, 12), date(2023, 1, 10))
+    assert reminders.due == {'Leap': date(2023, 2, 25), 'Late': date(2024, 1, 9)}
+    reminders._schedule('Leap', date(1996, 2, 29), date(2024, 1, 10))
+    assert reminders.due['Leap'] == date(2024, 2, 26)
+    assert reminders.heap[0] == (date(2023, 2, 25), 'Leap')    # stale, skipped by run() as due has another day
+
+
+def test_reminders_follow_the_book_and_fire_once():
+    today = date.today()
+    book = bot.AddressBook()
+    book.add_record(bot.Record(bot.Name('Ann'), birthday=bot.Birthday(today.replace(year=2000))))
+    book.add_record(bot.Record(bot.Name('Bob'), birthday=bot.Birthday(today.replace(year=2000) + timedelta(days=40))))
+    book.add_record(bot.Record(bot.Name('Eve')))
+    output = bot.CollectingView()
+    reminders = bot.BirthdayReminders(output=output)
+    reminders.watch(book)
+    assert set(reminders.due) == {'Ann', 'Bob'} and reminders.due['Ann'] == today
+
+    book.remove_record('Bob')
+    book.add_record(bot.Record(bot.Name('Eve'), birthday=bot.Birthday(today.replace(year=2000) + timedelta(days=100))))
+    assert set(reminders.due) == {'Ann', 'Eve'}
+
+    reminders.start()
+    for _ in range(100):
+        if output.lines:
+            break
+        time.sleep(0.02)
+    assert output.text().strip() == f'Today is the birthday of Ann, turning {today.year - 2000}'
+    reminders.watch(book)       # as after a reload
+    time.sleep(0.1)
+    assert len(output.lines) == 1
+    assert reminders.due['Ann'] > today
+
+
+def test_render_cache_is_bounded_and_follows_changes(monkeypatch):
+    monkeypatch.setattr(bot, 'RENDER_CACHE_SIZE', 8)
+    monkeypatch.setattr(bot, 'rendered', bot.OrderedDict())
+    rng = random.Random(9)
+    records = [random_record(rng, f'Contact {i}') for i in range(20)]
+    notices = [random_notice(rng) for _ in range(20)]
+    texts = [str(item) for item in records + notices]
+    assert len(bot.rendered) == 8
+    assert [str(item) for item in records + notices] == texts
+
+    record, notice = records[0], notices[0]
+    record.address = bot.Address('Sadova 2')
+    assert 'Address: Sadova 2' in str(record)
+    notice.add_note(bot.Note('one more'))
+    assert 'one more' in str(notice) and 'one more' in notice.show()
+    assert not hasattr(notice, '_rendered') and len(bot.rendered) == 8
+
+
+def test_sorting_files_leaves_the_storage_files(tmp_path):
+    own = ['backup.dat', 'backup.journal', 'book.db', 'book.db-journal', 'backup.shards', 'backup.0.dat',
+           'backup.12.journal', 'backup.1.dat.tmp', 'backup.dat.tmp']
+    for name in own + ['photo.jpg', 'backup.x.dat']:
+        (tmp_path / name).write_bytes(b'x')
+    moved = {os.path.basename(source) for source, _ in bot.plan_file_moves(str(tmp_path))}
+    assert moved == {'photo.jpg', 'backup.x.dat'}
+
+
+def test_sort_files_plan_and_moves(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / bot.CATEGORIES_FILE).write_text('{"Pictures": [".jpg"]}', encoding='utf-8')
+    (tmp_path / 'Pictures').mkdir()
+    (tmp_path / 'Pictures' / 'a.jpg').write_bytes(b'old')
+    (tmp_path / 'sub').mkdir()
+    for name in ('a.jpg', 'notes.txt', 'sub/b.JPG'):
+        (tmp_path / name).write_bytes(name.encode())
+
+    plan = bot.plan_file_moves(str(tmp_path), True, bot.load_file_categories())
+    moves = sorted((os.path.relpath(source, tmp_path), os.path.relpath(destination, tmp_path)) for source, destination in plan)
+    assert moves == [('a.jpg', os.path.join('Pictures', 'a (1).jpg')), ('notes.txt', os.path.join('Other', 'notes.txt')),
+                     (os.path.join('sub', 'b.JPG'), os.path.join('Pictures', 'b.JPG'))]
+
+    assert bot.execute_file_moves(plan) == []
+    assert (tmp_path / 'Pictures' / 'a (1).jpg').read_bytes() == b'a.jpg'
+    assert (tmp_path / 'Pictures' / 'a.jpg').read_bytes() == b'old'
+    assert (tmp_path / bot.CATEGORIES_FILE).exists()
+
+
+def test_duplicates_are_found_by_content(tmp_path):
+    big = bytes(range(256)) * 1024      # larger than HEAD_SIZE, told apart by the full hash
+    files = {'a.txt': b'same', 'b.txt': b'same', 'c.txt': b'diff', 'empty1': b'', 'empty2': b'',
+             'big1': big + b'1', 'big2': big + b'1', 'big3': big + b'2'}
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    paths = [str(tmp_path / name) for name in files]
+    assert bot.find_duplicates(paths) == [[str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')],
+                                          [str(tmp_path / 'big1'), str(tmp_path / 'big2')]]
+
+    plan = bot.plan_file_moves(str(tmp_path))
+    plan = bot.quarantine_duplicates(plan, str(tmp_path), bot.find_duplicates(paths))
+    moved = {os.path.basename(source): os.path.relpath(destination, tmp_path) for source, destination in plan}
+    assert moved['b.txt'] == os.path.join(bot.DUPLICATES_FOLDER, 'b.txt')
+    assert moved['big2'] == os.path.join(bot.DUPLICATES_FOLDER, 'big2')
+    assert not moved['a.txt'].startswith(bot.DUPLICATES_FOLDER)     # the original is sorted as usual